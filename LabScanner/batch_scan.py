@@ -0,0 +1,301 @@
+"""
+Chemical Bottle Scanner - Headless Batch Mode
+=============================================
+不開鏡頭、不開視窗：把錄好的盤點影片或一整個資料夾的照片丟進來，
+用所有 CPU 核心跑 前處理 -> OCR -> CAS 擷取，最後輸出已掃到 / 缺漏報告。
+照片資料夾 (手機拍的整排櫃子) 會切成互相重疊的區塊分給工作池，一張照片可以掃到很多瓶。
+
+用法:
+    python batch_scan.py inventory.csv shelf_walk.mp4 -o reports/
+    python batch_scan.py inventory.csv photos/ -o reports/ --workers 8
+    python batch_scan.py inventory.csv photos/ --tile 0     # 不切塊，每張照片整張辨識
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Dict, Iterator, List, Set, Tuple
+
+import cv2
+import numpy as np
+
+import cas_scanner
+from cas_scanner import InventoryManager, OCRScheduler, _init_ocr_worker, _ocr_job
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+# 照片切塊：區塊邊長與重疊寬度 (像素，原始解析度)；重疊要大於一張標籤的 CAS 行，
+# 標籤剛好落在兩塊交界時才至少有一塊能看到完整的文字
+PHOTO_TILE_SIZE = 1024
+PHOTO_TILE_OVERLAP = 192
+# 每個區塊最多辨識幾個文字行：一塊裡常有好幾張標籤，用鏡頭畫面的 ROI_MAX_REGIONS 只會留下最大的
+# 品名 / 廠牌行，CAS 行會被擠掉
+PHOTO_TILE_MAX_REGIONS = 32
+
+def read_image(path: str) -> np.ndarray:
+    """cv2.imread 在 Windows 上讀不到中文路徑，改用 imdecode"""
+    return cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def list_images(folder: str) -> List[str]:
+    return sorted(n for n in os.listdir(folder) if n.lower().endswith(IMAGE_EXTENSIONS))
+
+def iter_frames(source: str, stride: int = 1) -> Iterator[Tuple[int, np.ndarray]]:
+    """依序產生 (frame_id, frame)：資料夾就逐張讀照片，否則當成影片檔"""
+    if os.path.isdir(source):
+        for i, name in enumerate(list_images(source)):
+            frame = read_image(os.path.join(source, name))
+            if frame is None:
+                print(f"[WARN] 無法讀取影像: {name}")
+                continue
+            yield i, frame
+        return
+
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video: {source}")
+    frame_id = 0
+    try:
+        while True:
+            # 跳過的幀只 grab 不 decode，比 read() 快很多
+            if frame_id % stride:
+                if not cap.grab(): break
+            else:
+                ret, frame = cap.read()
+                if not ret: break
+                yield frame_id, frame
+            frame_id += 1
+    finally:
+        cap.release()
+
+def tile_boxes(width: int, height: int, size: int = PHOTO_TILE_SIZE,
+               overlap: int = PHOTO_TILE_OVERLAP) -> List[Tuple[int, int, int, int]]:
+    """把 width x height 的影像切成互相重疊的區塊 (x, y, w, h)；最後一排/列貼齊邊緣，不會切出細長的碎片"""
+    def starts(length: int) -> List[int]:
+        if length <= size:
+            return [0]
+        step = max(1, size - overlap)
+        positions = list(range(0, length - size, step))
+        return positions + [length - size]
+    return [(x, y, min(size, width), min(size, height)) for y in starts(height) for x in starts(width)]
+
+def create_executor(mode: str, workers: int, inventory: InventoryManager):
+    cas_scanner.set_catalog_index(inventory.catalog)
+    if mode == 'process':
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker,
+                                   initargs=(cas_scanner.get_tesseract_cmd(), inventory.catalog))
+    return ThreadPoolExecutor(max_workers=workers)
+
+def resolve_tesseract(path: str) -> str:
+    """設定檔裡的 Windows 路徑不存在時 (例如在伺服器上)，改用 PATH 上的 tesseract"""
+    if os.path.isfile(path):
+        return path
+    return shutil.which('tesseract') or path
+
+def run_batch(inventory: InventoryManager, source: str, workers: int,
+              mode: str = 'process', stride: int = 1, use_scheduler: bool = True) -> dict:
+    """掃描整個來源，結果直接記錄在 inventory；回傳統計數字"""
+    executor = create_executor(mode, workers, inventory)
+
+    # 照片資料夾每張都不同，不需要排程器；影片則跳過模糊與重複的畫面
+    scheduler = OCRScheduler(min_interval=1) if use_scheduler and not os.path.isdir(source) else None
+    max_in_flight = workers * 2  # 限制同時排隊的影格數，避免整支影片塞進記憶體
+    in_flight = set()
+    stats = {'frames': 0, 'ocr_frames': 0, 'hits': 0, 'barcode_frames': 0}
+
+    def collect(done):
+        for future in done:
+            result = future.result()
+            if result.code_cas:
+                # 條碼解出 CAS 的影格沒有跑 OCR
+                stats['barcode_frames'] += 1
+                matches = [info for info in (inventory.lookup(cas, match_type='barcode') for cas in result.code_cas) if info]
+            else:
+                matches = [info for info in map(inventory.lookup, result.cas_numbers) if info]
+            # CAS 讀不到 -> 改用藥品名稱比對
+            if not matches and not result.code_cas and cas_scanner.ENABLE_NAME_MATCH and result.text:
+                matches = [info for info in [inventory.fuzzy_match_name(result.text)] if info]
+            for info in matches:
+                stats['hits'] += 1
+                if scheduler is not None:
+                    scheduler.mark_matched(result.frame_id)
+                print(f"[FOUND] frame {result.frame_id}: {info['CAS']} @ {info['Location']} ({info['match_type']})")
+
+    start = time.perf_counter()
+    with executor:
+        for frame_id, frame in iter_frames(source, stride):
+            stats['frames'] += 1
+            if scheduler is not None and not scheduler.should_ocr(frame_id, frame):
+                continue
+            stats['ocr_frames'] += 1
+            in_flight.add(executor.submit(_ocr_job, frame_id, frame))
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+        done, _ = wait(in_flight)
+        collect(done)
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['fps'] = stats['frames'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    stats['ocr_saved'] = scheduler.saved if scheduler is not None else 0
+    return stats
+
+def run_photos(inventory: InventoryManager, folder: str, workers: int, mode: str = 'process',
+               tile: int = PHOTO_TILE_SIZE, overlap: int = PHOTO_TILE_OVERLAP,
+               max_regions: int = PHOTO_TILE_MAX_REGIONS) -> dict:
+    """
+    大量照片盤點：每張照片切塊後分給工作池 (條碼 -> 前處理 -> OCR -> CAS 擷取)，
+    所有結果併入同一個 inventory。重疊區塊讀到的同一瓶在同一張照片內只算一次。
+    回傳統計數字，stats['rows'] 為每張照片掃到的藥品 (image, CAS, Name, Location, match)。
+    """
+    executor = create_executor(mode, workers, inventory)
+    max_in_flight = workers * 2  # 高解析度照片很佔記憶體，只讓少數區塊排隊
+    in_flight = set()
+    tile_owner: Dict[int, int] = {}     # tile_id -> 照片編號
+    tiles_left: Dict[int, int] = {}     # 照片編號 -> 還沒完成的區塊數
+    seen: Dict[int, Set[str]] = {}      # 照片編號 -> 已記錄的 CAS
+    names: List[str] = []
+    stats = {'images': 0, 'tiles': 0, 'hits': 0, 'barcode_tiles': 0, 'unreadable': 0, 'rows': []}
+
+    def record(image_id: int, info: dict):
+        if info['CAS'] in seen[image_id]:
+            return
+        seen[image_id].add(info['CAS'])
+        stats['hits'] += 1
+        stats['rows'].append((names[image_id], info['CAS'], info['Name'], info['Location'], info['match_type']))
+        print(f"[FOUND] {names[image_id]}: {info['CAS']} @ {info['Location']} ({info['match_type']})")
+
+    def collect(done):
+        for future in done:
+            result = future.result()
+            image_id = tile_owner.pop(result.frame_id)
+            if result.code_cas:
+                stats['barcode_tiles'] += 1
+                for cas in result.code_cas:
+                    if cas not in seen[image_id]:
+                        info = inventory.lookup(cas, names[image_id], match_type='barcode')
+                        if info: record(image_id, info)
+            else:
+                found = False
+                for cas in result.cas_numbers:
+                    if cas in seen[image_id]:
+                        found = True
+                        continue
+                    info = inventory.lookup(cas, names[image_id])
+                    if info:
+                        found = True
+                        record(image_id, info)
+                # 這一塊讀不到 CAS -> 改用藥品名稱比對
+                if not found and cas_scanner.ENABLE_NAME_MATCH and result.text:
+                    info = inventory.fuzzy_match_name(result.text, source=names[image_id])
+                    if info: record(image_id, info)
+            tiles_left[image_id] -= 1
+            if tiles_left[image_id] == 0:
+                del tiles_left[image_id]
+                print(f"[INFO] {names[image_id]}: {len(seen.pop(image_id))} bottles")
+
+    start = time.perf_counter()
+    with executor:
+        for name in list_images(folder):
+            image = read_image(os.path.join(folder, name))
+            if image is None:
+                print(f"[WARN] 無法讀取影像: {name}")
+                stats['unreadable'] += 1
+                continue
+            image_id = len(names)
+            names.append(name)
+            stats['images'] += 1
+            h, w = image.shape[:2]
+            boxes = tile_boxes(w, h, tile, overlap) if tile > 0 else [(0, 0, w, h)]
+            tiles_left[image_id] = len(boxes)
+            seen[image_id] = set()
+            for x, y, tw, th in boxes:
+                tile_id = stats['tiles']
+                stats['tiles'] += 1
+                tile_owner[tile_id] = image_id
+                # 切片是原圖的 view；多行程模式會 pickle 成獨立陣列，多執行緒模式則共用原圖
+                in_flight.add(executor.submit(_ocr_job, tile_id, image[y:y + th, x:x + tw],
+                                              max_regions=max_regions))
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+        done, _ = wait(in_flight)
+        collect(done)
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['images_per_sec'] = stats['images'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    stats['tiles_per_sec'] = stats['tiles'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    return stats
+
+def write_photo_results(rows: List[tuple], output_dir: str) -> str:
+    """每張照片掃到哪些藥品 (方便回頭找某一瓶在哪張照片裡)"""
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"photo_results_{datetime.now():%Y%m%d_%H%M}.csv")
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Image', 'CAS', 'Name', 'Location', 'Match'])
+        writer.writerows(rows)
+    return path
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Headless batch scan of a video file or a folder of photos.")
+    parser.add_argument('inventory', help="庫存清單 CSV")
+    parser.add_argument('source', help="盤點影片檔，或放照片的資料夾")
+    parser.add_argument('-o', '--output', default=cas_scanner.DATA_FOLDER, help="報告輸出資料夾")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help="平行工作數 (預設: CPU 核心數)")
+    parser.add_argument('--mode', choices=('process', 'thread'), default='process', help="多行程或多執行緒")
+    parser.add_argument('--stride', type=int, default=1, help="影片每隔幾幀取一幀")
+    parser.add_argument('--no-scheduler', action='store_true', help="影片的每一幀都做 OCR (不略過模糊/重複畫面)")
+    parser.add_argument('--tile', type=int, default=PHOTO_TILE_SIZE, help="照片切塊邊長 (像素，0 = 不切塊)")
+    parser.add_argument('--overlap', type=int, default=PHOTO_TILE_OVERLAP, help="相鄰區塊重疊寬度 (像素)")
+    parser.add_argument('--max-regions', type=int, default=PHOTO_TILE_MAX_REGIONS,
+                        help="照片每個區塊最多辨識幾個文字行")
+    parser.add_argument('--tesseract', default=cas_scanner.TESSERACT_PATH, help="tesseract 執行檔路徑")
+    args = parser.parse_args(argv)
+
+    cas_scanner.set_tesseract_cmd(resolve_tesseract(args.tesseract))
+
+    inventory = InventoryManager(args.inventory)
+    if inventory.total_count == 0:
+        print("[ERROR] Inventory empty or load failed.")
+        return 1
+
+    print(f"[INFO] Scanning {args.source} with {args.workers} {args.mode} workers...")
+    photos = os.path.isdir(args.source)
+    try:
+        if photos:
+            stats = run_photos(inventory, args.source, max(1, args.workers), args.mode,
+                               max(0, args.tile), max(0, min(args.overlap, args.tile // 2)), max(1, args.max_regions))
+        else:
+            stats = run_batch(inventory, args.source, max(1, args.workers), args.mode,
+                              max(1, args.stride), not args.no_scheduler)
+    except IOError as e:
+        print(f"[ERROR] {e}")
+        return 1
+
+    found_path = inventory.generate_found_report(args.output)
+    missing_path = inventory.generate_report(args.output)
+
+    print("=" * 60)
+    if photos:
+        results_path = write_photo_results(stats['rows'], args.output)
+        print(f"[OK] {stats['images']} images ({stats['tiles']} tiles) in {stats['seconds']:.1f}s "
+              f"({stats['images_per_sec']:.2f} images/sec, {stats['tiles_per_sec']:.1f} tiles/sec), "
+              f"{stats['hits']} bottles found, {stats['barcode_tiles']} tiles read by barcode")
+        if stats['unreadable']:
+            print(f"[WARN] {stats['unreadable']} images could not be read")
+        print(f"[OK] Per-photo results: {results_path}")
+    else:
+        print(f"[OK] {stats['frames']} frames in {stats['seconds']:.1f}s ({stats['fps']:.1f} frames/sec), "
+              f"OCR on {stats['ocr_frames']} (saved {stats['ocr_saved']}, {stats['barcode_frames']} read by barcode)")
+    print(f"[OK] Scanned: {inventory.scanned_count} / {inventory.total_count}")
+    print(f"[OK] Found report:   {found_path}")
+    print(f"[OK] Missing report: {missing_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
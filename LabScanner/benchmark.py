@@ -0,0 +1,331 @@
+"""
+Chemical Bottle Scanner - Benchmark
+===================================
+量測掃描流程各階段的延遲 (p50/p90/p95/p99) 與整體吞吐量，同時計算 CAS 辨識率
+(recall / precision)，避免「變快了但讀不到」的改動。結果輸出成 JSON 方便比較。
+
+測試影像由 fix_csv.py 與庫存 CSV 裡的 CAS / 藥名合成 (可固定亂數種子重現)，
+也可以用 --corpus 指定一個錄好的影像資料夾 (需附 labels.csv: filename,CAS)。
+
+用法:
+    python benchmark.py -o bench_before.json
+    python benchmark.py -o bench_after.json --baseline bench_before.json
+    python benchmark.py --compare auto onnx -o bench_backends.json   # 同一批影像比較 OCR 後端
+"""
+
+import argparse
+import ast
+import csv
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import cas_scanner
+from cas_scanner import (InventoryManager, draw_overlay, extract_cas_numbers,
+                         perform_ocr, preprocess_frame, recognize_frame)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INVENTORY = os.path.join(SCRIPT_DIR, 'Clean_Inventory.csv')
+
+# 每張合成影像: (frame, 正確的 CAS 集合)
+Sample = Tuple[np.ndarray, List[str]]
+
+# =============================================================================
+# 測試資料
+# =============================================================================
+
+def load_fix_csv_rows(path: str = os.path.join(SCRIPT_DIR, 'fix_csv.py')) -> List[Tuple[str, str, str, str]]:
+    """從 fix_csv.py 取出 data 清單 (用 ast 解析，不執行該腳本以免寫檔)"""
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'data' for t in node.targets):
+            return [tuple(row) for row in ast.literal_eval(node.value)]
+    return []
+
+def load_label_rows(inventory: InventoryManager) -> List[Tuple[str, str, str, str]]:
+    """fix_csv.py 與庫存 CSV 的 (CAS, 名稱, 廠牌, 數量)，以 CAS 去除重複"""
+    rows = {}
+    for cas, name, brand, stock in load_fix_csv_rows():
+        rows.setdefault(cas, (cas, name, brand, stock))
+    for r in inventory._records:
+        if r.cas:
+            rows.setdefault(r.cas, (r.cas, r.name, r.location, r.stock))
+    return list(rows.values())
+
+def _ascii(text: str) -> str:
+    # Hershey 字型只能畫 ASCII (例如 ε、β 會變成 ?)
+    return text.encode('ascii', 'replace').decode('ascii')
+
+def render_label(row: Tuple[str, str, str, str], rng: random.Random,
+                 size: Tuple[int, int] = (1280, 720)) -> np.ndarray:
+    """把一筆藥品畫成「鏡頭前的藥罐標籤」：背景雜訊、標籤、輕微旋轉/模糊/亮度變化"""
+    cas, name, brand, stock = row
+    w, h = size
+    frame = np.full((h, w, 3), rng.randint(40, 140), np.uint8)
+    frame = cv2.add(frame, np.random.default_rng(rng.randint(0, 2**31)).integers(0, 25, frame.shape, dtype=np.uint8))
+
+    scale = rng.uniform(0.7, 1.2)
+    label_w, label_h = int(560 * scale), int(300 * scale)
+    x0 = rng.randint(40, w - label_w - 40)
+    y0 = rng.randint(40, h - label_h - 40)
+    paper = rng.randint(200, 250)
+    cv2.rectangle(frame, (x0, y0), (x0 + label_w, y0 + label_h), (paper, paper, paper), -1)
+
+    font = cas_scanner.FONT
+    lines = [
+        (_ascii(brand), 0.9, 2),
+        (_ascii(name)[:32], 0.8, 2),
+        (f"CAS No. {cas}", 0.9, 2),
+        (f"Lot {rng.randint(10000, 99999)}   {_ascii(stock)}", 0.6, 1),
+    ]
+    y = y0 + int(55 * scale)
+    for text, font_scale, thickness in lines:
+        cv2.putText(frame, text, (x0 + int(20 * scale), y), font, font_scale * scale, (20, 20, 20), thickness)
+        y += int(65 * scale)
+
+    angle = rng.uniform(-4, 4)
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    frame = cv2.warpAffine(frame, matrix, (w, h), borderMode=cv2.BORDER_REPLICATE)
+    if rng.random() < 0.3:
+        k = rng.choice((3, 5))
+        frame = cv2.GaussianBlur(frame, (k, k), 0)
+    return cv2.convertScaleAbs(frame, alpha=rng.uniform(0.8, 1.2), beta=rng.uniform(-20, 20))
+
+def synthetic_corpus(inventory: InventoryManager, count: int, seed: int = 0) -> List[Sample]:
+    rng = random.Random(seed)
+    rows = load_label_rows(inventory)
+    return [(render_label(row, rng), [row[0]]) for row in (rng.choice(rows) for _ in range(count))]
+
+def load_corpus(folder: str) -> List[Sample]:
+    """錄好的影像資料夾：labels.csv 每列 filename,CAS (CAS 可用 ; 分隔多個或留空)"""
+    samples = []
+    with open(os.path.join(folder, 'labels.csv'), encoding='utf-8-sig', newline='') as f:
+        for row in csv.reader(f):
+            if not row or row[0].lower() == 'filename':
+                continue
+            frame = cv2.imdecode(np.fromfile(os.path.join(folder, row[0]), dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                continue
+            truth = [c.strip() for c in (row[1] if len(row) > 1 else '').split(';') if c.strip()]
+            samples.append((frame, truth))
+    return samples
+
+# =============================================================================
+# 量測
+# =============================================================================
+
+class StageTimer:
+    """收集每個階段每次呼叫的耗時 (毫秒)"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+
+    def measure(self, stage: str, func: Callable, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.samples.setdefault(stage, []).append((time.perf_counter() - start) * 1000.0)
+        return result
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        for stage, values in self.samples.items():
+            arr = np.asarray(values)
+            out[stage] = {
+                'count': int(arr.size),
+                'mean_ms': float(arr.mean()),
+                'p50_ms': float(np.percentile(arr, 50)),
+                'p90_ms': float(np.percentile(arr, 90)),
+                'p95_ms': float(np.percentile(arr, 95)),
+                'p99_ms': float(np.percentile(arr, 99)),
+                'max_ms': float(arr.max()),
+            }
+        return out
+
+def accuracy(predictions: List[List[str]], truths: List[List[str]]) -> Dict[str, float]:
+    tp = fp = fn = 0
+    for pred, truth in zip(predictions, truths):
+        pred, truth = set(pred), set(truth)
+        tp += len(pred & truth)
+        fp += len(pred - truth)
+        fn += len(truth - pred)
+    return {
+        'true_positives': tp,
+        'false_positives': fp,
+        'false_negatives': fn,
+        'recall': tp / (tp + fn) if tp + fn else 0.0,
+        'precision': tp / (tp + fp) if tp + fp else 0.0,
+    }
+
+def run_benchmark(inventory_path: str, samples: List[Sample], full_frame: bool = True,
+                  warmup: int = 2) -> dict:
+    """逐張跑完整流程並分階段計時"""
+    inventory = InventoryManager(inventory_path)
+    timer = StageTimer()
+    predictions = []
+
+    for frame, _ in samples[:warmup]:
+        recognize_frame(frame)
+
+    start = time.perf_counter()
+    for frame, _ in samples:
+        t0 = time.perf_counter()
+        text = timer.measure('recognize_frame', recognize_frame, frame)
+        cas_list = timer.measure('extract_cas_numbers', extract_cas_numbers, text)
+        info = None
+        for cas in cas_list:
+            info = timer.measure('lookup', inventory.lookup, cas) or info
+        timer.measure('draw_overlay', draw_overlay, frame, info, inventory, 30.0)
+        timer.samples.setdefault('end_to_end', []).append((time.perf_counter() - t0) * 1000.0)
+        predictions.append(cas_list)
+
+        # 舊的整張畫面流程 (前處理 + 整張 OCR) 分開計時，方便比較
+        if full_frame:
+            binary = timer.measure('preprocess_frame', preprocess_frame, frame)
+            timer.measure('perform_ocr', perform_ocr, binary)
+    elapsed = time.perf_counter() - start
+
+    pipeline_ms = sum(timer.samples['end_to_end'])
+    return {
+        'stages': timer.summary(),
+        'throughput_fps': len(samples) / (pipeline_ms / 1000.0) if pipeline_ms else 0.0,
+        'wall_seconds': elapsed,
+        'accuracy': accuracy(predictions, [truth for _, truth in samples]),
+    }
+
+def environment_info() -> dict:
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'opencv': cv2.__version__,
+        'ocr_backend': cas_scanner.get_ocr_backend().name,
+        'config': {
+            'OCR_USE_ROI': cas_scanner.OCR_USE_ROI,
+            'OCR_CONFIG': cas_scanner.OCR_CONFIG,
+            'ROI_OCR_CONFIG': cas_scanner.ROI_OCR_CONFIG,
+            'OCR_CACHE_SIZE': cas_scanner.OCR_CACHE.max_size,
+        },
+    }
+
+def print_report(result: dict, baseline: Optional[dict] = None):
+    print(f"{'stage':<22}{'p50':>10}{'p95':>10}{'p99':>10}   (ms)")
+    for stage, s in result['stages'].items():
+        line = f"{stage:<22}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}"
+        old = (baseline or {}).get('stages', {}).get(stage)
+        if old and old['p50_ms'] > 0:
+            line += f"   p50 {100.0 * (s['p50_ms'] / old['p50_ms'] - 1):+.1f}%"
+        print(line)
+    acc = result['accuracy']
+    print(f"throughput: {result['throughput_fps']:.1f} frames/sec")
+    print(f"CAS recall: {acc['recall']:.1%}  precision: {acc['precision']:.1%}")
+    if baseline:
+        old_acc = baseline['accuracy']
+        print(f"vs baseline: throughput {baseline['throughput_fps']:.1f} -> {result['throughput_fps']:.1f} fps, "
+              f"recall {old_acc['recall']:.1%} -> {acc['recall']:.1%}, "
+              f"precision {old_acc['precision']:.1%} -> {acc['precision']:.1%}")
+
+def print_comparison(results: Dict[str, dict]):
+    """各 OCR 後端在同一批影像上的延遲、吞吐量與辨識率"""
+    print(f"{'backend':<14}{'frame p50':>11}{'frame p95':>11}{'fps':>8}{'recall':>9}{'precision':>11}")
+    for name, result in results.items():
+        frame = result['stages']['recognize_frame']
+        acc = result['accuracy']
+        print(f"{name:<14}{frame['p50_ms']:>11.1f}{frame['p95_ms']:>11.1f}{result['throughput_fps']:>8.1f}"
+              f"{acc['recall']:>9.1%}{acc['precision']:>11.1%}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the scanning pipeline (latency + CAS accuracy).")
+    parser.add_argument('--inventory', default=DEFAULT_INVENTORY, help="庫存清單 CSV")
+    parser.add_argument('--corpus', help="錄好的影像資料夾 (含 labels.csv)；不指定則使用合成影像")
+    parser.add_argument('-n', '--count', type=int, default=60, help="合成影像張數")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save-corpus', help="把合成影像與 labels.csv 存到這個資料夾 (之後可用 --corpus 重跑)")
+    parser.add_argument('--backend', help="OCR 後端 (預設依 cas_scanner.OCR_BACKEND)")
+    parser.add_argument('--compare', nargs='+', metavar='BACKEND', help="在同一批影像上依序量測多個 OCR 後端並比較")
+    parser.add_argument('--full-frame', action='store_true', help="使用舊的整張畫面 OCR 取代 ROI 流程")
+    parser.add_argument('--skip-legacy', action='store_true', help="不另外量測 preprocess_frame / 整張 perform_ocr")
+    parser.add_argument('--with-cache', action='store_true', help="保留 OCR 結果快取 (預設關閉，量測的是真實 OCR)")
+    parser.add_argument('--tesseract', default=cas_scanner.TESSERACT_PATH, help="tesseract 執行檔路徑")
+    parser.add_argument('-o', '--output', help="結果 JSON 輸出路徑")
+    parser.add_argument('--baseline', help="之前的結果 JSON，用來比較")
+    args = parser.parse_args(argv)
+
+    from batch_scan import resolve_tesseract
+    cas_scanner.set_tesseract_cmd(resolve_tesseract(args.tesseract))
+    if args.backend:
+        cas_scanner.set_ocr_backend(cas_scanner.create_ocr_backend(args.backend))
+    if args.full_frame:
+        cas_scanner.OCR_USE_ROI = False
+    if not args.with_cache:
+        cas_scanner.OCR_CACHE.max_size = 0
+
+    if args.corpus:
+        samples = load_corpus(args.corpus)
+    else:
+        samples = synthetic_corpus(InventoryManager(args.inventory), args.count, args.seed)
+    if not samples:
+        print("[ERROR] No benchmark samples.")
+        return 1
+
+    if args.save_corpus:
+        os.makedirs(args.save_corpus, exist_ok=True)
+        with open(os.path.join(args.save_corpus, 'labels.csv'), 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['filename', 'CAS'])
+            for i, (frame, truth) in enumerate(samples):
+                name = f"frame_{i:04d}.png"
+                cv2.imwrite(os.path.join(args.save_corpus, name), frame)
+                writer.writerow([name, ';'.join(truth)])
+
+    if args.compare:
+        results = {}
+        for name in args.compare:
+            try:
+                cas_scanner.set_ocr_backend(cas_scanner.create_ocr_backend(name))
+            except (ImportError, OSError, ValueError) as e:
+                print(f"[WARN] Skipping backend {name}: {e}")
+                continue
+            print(f"[INFO] Benchmarking {len(samples)} frames with {name}...")
+            results[name] = run_benchmark(args.inventory, samples, full_frame=not args.skip_legacy)
+            results[name]['ocr_backend'] = cas_scanner.get_ocr_backend().name
+            print_report(results[name])
+        if not results:
+            print("[ERROR] No OCR backend could be loaded.")
+            return 1
+        print_comparison(results)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({'environment': environment_info(), 'samples': len(samples), 'backends': results},
+                          f, indent=2, ensure_ascii=False)
+            print(f"[OK] Results saved to: {args.output}")
+        return 0
+
+    print(f"[INFO] Benchmarking {len(samples)} frames...")
+    result = run_benchmark(args.inventory, samples, full_frame=not args.skip_legacy)
+    result['environment'] = environment_info()
+    result['samples'] = len(samples)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"[OK] Results saved to: {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
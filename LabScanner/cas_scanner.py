@@ -7,20 +7,44 @@ Features:
 3. Scanned History Sidebar (Shows last 8 items) [NEW]
 4. Missing Items Report Generation
 5. Robust CSV Handling (utf-8-sig)
+6. Background OCR Worker Pool (thread / process, drops stale frames)
+7. Text Region Detection (OCR only label text lines, not the full frame)
+8. Adaptive OCR Scheduling (skips blurry / unchanged frames)
+9. OCR Result Cache (perceptual hash LRU with TTL)
+10. Pluggable OCR Backends (persistent tesserocr engine, pytesseract fallback)
+11. Cached HUD Layers (sprites redrawn only when their data changes)
+12. Fuzzy Name Matching (trigram index shortlist when the CAS is unreadable)
+13. Multi-Camera Scanning (one capture thread per source, shared OCR pool and session)
+14. Multi-Frame CAS Voting (confidence-weighted consensus before a read counts as found)
+15. Scan Journal (append-only, fsync-batched; an interrupted session resumes on restart)
+16. SQLite Inventory Store (many cabinet CSVs in one database, per-session sightings)
+17. Scan Loop Telemetry (per-stage p50/p95/p99, debug HUD page, JSON/CSV dumps, Prometheus endpoint)
+18. Barcode / QR / DataMatrix Fast Path (catalog number -> CAS index, OCR only when no code resolves)
+19. ONNX Runtime CRNN Backend (CPU neural line recognizer, batched over text regions)
 """
 
+import time
+_IMPORT_START = time.perf_counter()
+
 import cv2
-import pytesseract
-import pandas as pd
 import numpy as np
 import re
 import os
-import time
-import tkinter as tk
-from tkinter import filedialog
+import csv
+import hashlib
+import json
+import pickle
+import queue
+import socket
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, Tuple, List, Dict, Set
-from thefuzz import fuzz, process
+from typing import Optional, Tuple, List, Dict, Set, NamedTuple
+
+# pandas / pytesseract / thefuzz / tkinter 都改成用到時才載入，縮短啟動時間
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
 
 # =============================================================================
 # CONFIGURATION (設定)
@@ -29,12 +53,104 @@ from thefuzz import fuzz, process
 # Tesseract 執行檔路徑
 TESSERACT_PATH = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
+# 庫存快照：第一次載入 CSV 後在旁邊存一份預先建好索引的 .snapshot，CSV 沒變就直接讀快照
+USE_INVENTORY_SNAPSHOT = True
+INVENTORY_SNAPSHOT_VERSION = 1
+
+# 掃描日誌：每筆確認的掃描都附加寫入 CSV 旁的 .journal.jsonl，程式當掉後重開會接續同一次盤點
+ENABLE_SCAN_JOURNAL = True
+JOURNAL_FLUSH_EVERY = 20       # 累積幾筆就 fsync 一次
+JOURNAL_FLUSH_SECONDS = 1.0    # 或最多隔幾秒 fsync 一次 (當機最多遺失這段時間內的掃描)
+
+# 選 .db 庫存資料庫時這次要盤點哪幾櫃 (櫃名清單，例如 ['Clean_Inventory'])
+# None = 啟動時列出資料庫中的櫃子讓使用者選；沒選到的櫃子不會載入，也不會記錄掃到
+STORE_CABINETS = None
+
 # 攝影機索引
 CAMERA_INDEX = 0
 
+# 多鏡頭同時盤點：攝影機索引或串流網址 (DroidCam / IP 攝影機)，例如 [0, 1, 'http://192.168.1.20:4747/video']
+# None = 只用 CAMERA_INDEX
+CAMERA_SOURCES = None
+
 # 掃描頻率
 OCR_FRAME_INTERVAL = 10
 
+# OCR 引擎模式: 'sync' (在主迴圈內直接執行), 'thread' (執行緒池), 'process' (多行程池)
+# 背景模式下預覽畫面不會被 Tesseract 卡住，可考慮調低 OCR_FRAME_INTERVAL
+OCR_ENGINE_MODE = 'thread'
+
+# 背景 OCR 工作數量 (None = 依 CPU 核心數自動決定)
+OCR_WORKERS = None
+
+# 等待中的影格上限，滿了就丟掉最舊的 (避免辨識過時的畫面)
+OCR_QUEUE_SIZE = 2
+
+# 文字區域偵測 (ROI)：只對偵測到的標籤文字區塊做 OCR，而不是整張 1280x720
+OCR_USE_ROI = True
+ROI_DETECT_WIDTH = 640    # 偵測時先縮小到這個寬度以加速
+ROI_MAX_REGIONS = 6       # 每幀最多 OCR 幾個區塊
+ROI_MIN_TEXT_HEIGHT = 32  # 區塊高度小於此值時先放大再 OCR
+ROI_MAX_TEXT_HEIGHT = 96  # 區塊高度大於此值時先縮小再 OCR (字太大只會拖慢 Tesseract)
+
+# 前處理縮放的尺度金字塔：只從這幾個固定倍率挑選，讓區塊高度落在上面的範圍內
+OCR_SCALE_LEVELS = (0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0)
+FULL_FRAME_OCR_SCALE = 1.0  # 整張畫面 OCR (OCR_USE_ROI = False) 時的縮放倍率
+
+# 自適應 OCR 排程：畫面模糊或內容沒變 (已經掃到) 時跳過 OCR
+OCR_ADAPTIVE_SCHEDULER = True
+SHARPNESS_THRESHOLD = 60.0     # Laplacian 變異數低於此值視為模糊 (在 320 寬的灰階圖上計算)
+CHANGE_HASH_DISTANCE = 12      # 標籤雜湊 (256-bit) 漢明距離小於等於此值視為同一個畫面
+STATIC_RETRY_FRAMES = 30       # 畫面沒變時 (不論上次有沒有掃到東西)，隔多少幀再重試
+
+# OCR 結果快取 (以前處理後影像的感知雜湊為 key)：同一瓶藥放著不動時不用重跑 Tesseract
+OCR_CACHE_SIZE = 256          # 最多保留幾筆 (LRU)
+OCR_CACHE_TTL_SECONDS = 10.0  # 超過這個時間就失效
+
+# 藥品名稱模糊比對 (CAS 讀不到時的備援)
+ENABLE_NAME_MATCH = True
+NAME_MATCH_THRESHOLD = 80   # fuzz.ratio 分數門檻 (0~100)
+NAME_MATCH_SHORTLIST = 10   # 每行 OCR 文字最多評分幾個 trigram 候選
+
+# 多幀投票：同一個 CAS 在 CAS_VOTE_WINDOW_SECONDS 秒內累積的票數到達門檻才算掃到
+# 每次讀到的票數 = Tesseract 信心度 / 100 (100% 信心 = 1 票)，單次雜訊誤讀不會直接被記錄
+ENABLE_CAS_VOTING = True
+CAS_VOTE_THRESHOLD = 1.5
+CAS_VOTE_WINDOW_SECONDS = 3.0
+CAS_MIN_CONFIDENCE = 30.0   # 信心度低於此值的讀取不計票
+
+# 條碼快速通道：OCR 之前先解 QR / 一維條碼 / DataMatrix，解得出 CAS 就不跑 Tesseract
+# 型錄編號 -> CAS 對照來自庫存的 Catalog 欄位，以及 data/ 或庫存 CSV 旁的 catalog_index.csv (Catalog,CAS)
+ENABLE_BARCODE = True
+BARCODE_DETECT_WIDTH = 960          # 偵測前先縮小到這個寬度 (QR 偵測的耗時跟畫面大小成正比)
+BARCODE_DATAMATRIX_TIMEOUT_MS = 40  # pylibdmtx 每幀最多花幾毫秒找 DataMatrix
+CATALOG_INDEX_FILENAME = 'catalog_index.csv'
+CATALOG_MIN_PREFIX = 5              # 條碼比型錄編號長 (例如後面接包裝規格) 時，至少要有幾碼相符
+
+# OCR 後端: 'auto' (有裝 tesserocr 就用常駐引擎，否則 pytesseract), 'tesserocr', 'pytesseract',
+#          'onnx' (CRNN 辨識模型 + ONNX Runtime CPU，需要下面的模型檔)
+OCR_BACKEND = 'auto'
+
+# ONNX 辨識模型 (例如 PaddleOCR 英數辨識模型用 paddle2onnx 匯出) 與它的字典檔 (每行一個字元)
+ONNX_MODEL_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+ONNX_REC_MODEL = os.path.join(ONNX_MODEL_FOLDER, 'rec.onnx')
+ONNX_REC_CHARSET = os.path.join(ONNX_MODEL_FOLDER, 'rec_dict.txt')
+ONNX_REC_HEIGHT = 48        # 模型輸入高度 (PP-OCRv3/v4 = 48)
+ONNX_REC_MAX_WIDTH = 640    # 單行影像縮放後的最大寬度 (動態寬度模型)
+ONNX_REC_BATCH_SIZE = 8     # 一次推論幾行
+ONNX_THREADS = 0            # ONNX Runtime 運算執行緒數 (0 = 自動；多個 OCR 工作並行時建議設 1)
+
+# Tesseract 參數：整張畫面 / 單行區塊 / CAS 行 (只允許數字與連字號)
+OCR_CONFIG = '--oem 3 --psm 6'
+ROI_OCR_CONFIG = '--oem 3 --psm 7'
+CAS_LINE_OCR_CONFIG = '--oem 3 --psm 7 -c tessedit_char_whitelist=0123456789-'
+
+# 效能統計：掃描迴圈各階段耗時 (滾動 p50/p95/p99)；掃描時按 D 切換除錯 HUD 頁面
+ENABLE_METRICS = True
+METRICS_WINDOW = 1024          # 每個階段保留最近幾筆樣本
+METRICS_DUMP_SECONDS = 60.0    # 每隔幾秒把統計寫到 data/metrics_<主機名稱>.json / .csv (0 = 不寫)
+METRICS_HTTP_PORT = None       # 例如 9108：在 http://127.0.0.1:9108/metrics 提供 Prometheus 格式 (None = 關閉)
+
 # [新增] 結果停留時間 (秒) - 您可以在這裡調整時間
 RESULT_PERSISTENCE_SECONDS = 3.0
 
@@ -61,6 +177,10 @@ DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 
 def select_inventory_file() -> Optional[str]:
     """跳出視窗讓使用者選擇 CSV 檔案"""
+    # 只有互動模式才需要 tkinter (伺服器 / 批次模式可能沒有安裝)
+    import tkinter as tk
+    from tkinter import filedialog
+    
     root = tk.Tk()
     root.withdraw()
     root.attributes('-topmost', True)
@@ -70,267 +190,2562 @@ def select_inventory_file() -> Optional[str]:
     
     file_path = filedialog.askopenfilename(
         title="請選擇藥品庫存清單 (Select Inventory CSV)",
-        filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+        filetypes=[("CSV files", "*.csv"), ("Inventory database", "*.db *.sqlite"), ("All files", "*.*")],
         initialdir=default_dir
     )
     
     root.destroy()
     return file_path
 
+def select_cabinets(store: "InventoryStore") -> Optional[List[str]]:
+    """在主控台列出資料庫中的櫃子，讓使用者選這次要盤點哪幾櫃 (直接 Enter = 全部，q = 取消)"""
+    cabinets = store.cabinets()
+    if len(cabinets) <= 1:
+        return [name for name, _ in cabinets]
+    for i, (name, count) in enumerate(cabinets, 1):
+        print(f"    {i}. {name} ({count})")
+    while True:
+        answer = input("[INPUT] Cabinets to scan (e.g. 1,3; Enter = all, q = quit): ").strip()
+        if answer.lower() == 'q':
+            return None
+        if not answer:
+            return [name for name, _ in cabinets]
+        try:
+            picked = [int(part) for part in re.split(r'[\s,]+', answer) if part]
+        except ValueError:
+            picked = []
+        if picked and all(1 <= i <= len(cabinets) for i in picked):
+            return [cabinets[i - 1][0] for i in dict.fromkeys(picked)]
+        print(f"[WARN] Please enter numbers between 1 and {len(cabinets)}.")
+
 # =============================================================================
 # 核心邏輯 (OCR & 驗證)
 # =============================================================================
 
 def validate_cas_checksum(cas_number: str) -> bool:
-    """CAS 校驗碼驗證"""
-    try:
-        digits_only = cas_number.replace('-', '')
-        if not digits_only.isdigit() or len(digits_only) < 5:
-            return False
-        
-        check_digit = int(digits_only[-1])
-        digits_to_check = digits_only[:-1]
-        
-        checksum = 0
-        position = 1
-        
-        for digit in reversed(digits_to_check):
-            checksum += int(digit) * position
-            position += 1
-            
-        return (checksum % 10) == check_digit
-    except:
+    """CAS 校驗碼驗證 (單筆；實際計算在 validate_cas_batch)"""
+    digits_only = cas_number.replace('-', '')
+    if not digits_only.isdigit() or not 5 <= len(digits_only) <= _CAS_MAX_DIGITS:
         return False
+    return bool(validate_cas_batch([digits_only])[0])
+
+# OCR 常見的字元混淆：O/o -> 0, l/I -> 1, S -> 5, B -> 8
+OCR_CONFUSION_TABLE = str.maketrans({'O': '0', 'o': '0', 'l': '1', 'I': '1', 'S': '5', 'B': '8'})
+
+# 寬鬆的 CAS 候選：允許混淆字元與連字號旁的空白，之後再修正並驗證
+_CAS_CANDIDATE_PATTERN = re.compile(
+    r'(?<![A-Za-z0-9])([\dOolISB]{2,7})\s*-\s*([\dOolISB]{2})\s*-\s*([\dOolISB])(?![A-Za-z0-9])')
+
+# 校驗權重：去掉檢查碼後由右往左 1, 2, 3, ...；CAS 最多 10 位數 (7-2-1)
+_CAS_MAX_DIGITS = 10
+_CAS_WEIGHTS = np.arange(_CAS_MAX_DIGITS - 1, 0, -1, dtype=np.int64)
+
+def validate_cas_batch(candidates: List[str]) -> np.ndarray:
+    """
+    一次驗證多個純數字 CAS (不含連字號)，回傳 bool 陣列。
+    右對齊補 0 成 (n, 10) 的數字矩陣，與權重向量做一次矩陣乘法即可算出所有校驗和。
+    """
+    if not candidates:
+        return np.zeros(0, dtype=bool)
+    buffer = ''.join(c.rjust(_CAS_MAX_DIGITS, '0') for c in candidates).encode('ascii')
+    digits = (np.frombuffer(buffer, dtype=np.uint8) - ord('0')).astype(np.int64)
+    digits = digits.reshape(len(candidates), _CAS_MAX_DIGITS)
+    return (digits[:, :-1] @ _CAS_WEIGHTS) % 10 == digits[:, -1]
+
+def extract_cas_numbers_batch(texts: List[str]) -> List[List[str]]:
+    """
+    一次處理多段 OCR 文字 (例如多個 ROI 或批次模式)：
+    先擷取寬鬆候選並修正混淆字元，再把所有候選一起做向量化校驗。
+    """
+    owners: List[int] = []
+    candidates: List[str] = []
+    for i, text in enumerate(texts):
+        for head, middle, check in _CAS_CANDIDATE_PATTERN.findall(text):
+            # 前兩段至少要有一個真正的數字，避免把一般英文單字修成號碼
+            if not (any(c.isdigit() for c in head) and any(c.isdigit() for c in middle)):
+                continue
+            head, middle, check = (part.translate(OCR_CONFUSION_TABLE) for part in (head, middle, check))
+            if head[0] == '0':  # CAS 不會以 0 開頭
+                continue
+            owners.append(i)
+            candidates.append(f"{head}-{middle}-{check}")
+    
+    results: List[List[str]] = [[] for _ in texts]
+    valid = validate_cas_batch([c.replace('-', '') for c in candidates])
+    for owner, cas, ok in zip(owners, candidates, valid):
+        if ok and cas not in results[owner]:
+            results[owner].append(cas)
+    return results
 
 def extract_cas_numbers(text: str) -> List[str]:
     """從文字中提取有效的 CAS 號碼"""
-    cas_pattern = r'\b(\d{2,7}-\d{2}-\d)\b'
-    potential_cas = re.findall(cas_pattern, text)
-    valid_cas = [cas for cas in potential_cas if validate_cas_checksum(cas)]
-    return valid_cas
+    return extract_cas_numbers_batch([text])[0]
+
+def choose_scale(height: int, min_height: int = ROI_MIN_TEXT_HEIGHT, max_height: int = ROI_MAX_TEXT_HEIGHT,
+                 levels: Tuple[float, ...] = OCR_SCALE_LEVELS) -> float:
+    """從尺度金字塔挑一個倍率，讓文字區塊高度落在 [min_height, max_height]；已在範圍內就是 1.0"""
+    if height < min_height:
+        for level in sorted(levels):
+            if level > 1.0 and height * level >= min_height:
+                return level
+        return max(levels + (1.0,))
+    if height > max_height:
+        for level in sorted(levels, reverse=True):
+            if level < 1.0 and height * level <= max_height:
+                return level
+        return min(levels + (1.0,))
+    return 1.0
+
+class Preprocessor:
+    """
+    前處理流水線：灰階 -> (縮放) -> 高斯模糊 -> 自適應二值化 -> 閉運算。
+    每一步都用 OpenCV 的 dst= 寫進兩塊輪流使用的緩衝區，kernel 只建一次，每幀不再配置新影像。
+    run() 回傳的是內部緩衝區，在同一個執行緒下一次 run() 之前有效 (每個執行緒用 get_preprocessor())。
+    binarize=False 時只做灰階與縮放 (給吃灰階影像的辨識模型，見 OCRBackend.binary_input)。
+    """
+    KERNEL = np.ones((2, 2), np.uint8)
+
+    def __init__(self):
+        self._buffers = [np.empty(0, np.uint8), np.empty(0, np.uint8)]
+        self.allocations = 0
+
+    def _view(self, index: int, h: int, w: int) -> np.ndarray:
+        # 一維緩衝區取前 h*w 個再 reshape：得到連續記憶體的影像，傳給 Tesseract 時不必再複製
+        if self._buffers[index].size < h * w:
+            self._buffers[index] = np.empty(int(h * w * 1.5), np.uint8)  # 多留一些，避免尺寸稍大就重新配置
+            self.allocations += 1
+        return self._buffers[index][:h * w].reshape(h, w)
+
+    def run(self, image: np.ndarray, scale: float = 1.0, binarize: bool = True) -> np.ndarray:
+        h, w = image.shape[:2]
+        src, slot = image, 0
+        if image.ndim == 3:
+            src = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self._view(slot, h, w))
+            slot = 1
+        if scale != 1.0:
+            # 先轉灰階再縮放，只需處理單通道
+            h, w = max(1, round(h * scale)), max(1, round(w * scale))
+            interpolation = cv2.INTER_CUBIC if scale > 1.0 else cv2.INTER_AREA
+            src = cv2.resize(src, (w, h), dst=self._view(slot, h, w), interpolation=interpolation)
+            slot ^= 1
+        if not binarize:
+            return src
+        blurred = cv2.GaussianBlur(src, (5, 5), 0, dst=self._view(slot, h, w))
+        thresh = cv2.adaptiveThreshold(
+            blurred, 255, 
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+            cv2.THRESH_BINARY, 11, 2,
+            dst=self._view(slot ^ 1, h, w)
+        )
+        return cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, self.KERNEL, dst=self._view(slot, h, w))
+
+_preprocessors = threading.local()
+
+def get_preprocessor() -> Preprocessor:
+    """目前執行緒的前處理流水線 (OCR 工作執行緒各自一份緩衝區)"""
+    preprocessor = getattr(_preprocessors, 'instance', None)
+    if preprocessor is None:
+        preprocessor = _preprocessors.instance = Preprocessor()
+    return preprocessor
 
 def preprocess_frame(frame: np.ndarray) -> np.ndarray:
-    """影像前處理"""
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    thresh = cv2.adaptiveThreshold(
-        blurred, 255, 
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-        cv2.THRESH_BINARY, 11, 2
-    )
-    kernel = np.ones((2, 2), np.uint8)
-    return cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
+    """影像前處理 (回傳獨立的新影像；OCR 流程直接用 get_preprocessor().run() 省下複製)"""
+    return get_preprocessor().run(frame).copy()
 
 # =============================================================================
 # 庫存管理類別 (Inventory Manager)
 # =============================================================================
 
+# CSV 中文標題 -> 程式內部使用的英文欄位
+INVENTORY_HEADER_MAPPING = {
+    'CAS': 'CAS',
+    '上層藥品名稱': 'Name',
+    '廠牌': 'Location',
+    '數量': 'Stock',
+    '型錄編號': 'Catalog',
+    '貨號': 'Catalog'
+}
+
+class InventoryRecord(NamedTuple):
+    """單筆庫存 (不可變，取代 pandas row)；row 為在 DataFrame 中的位置，供報告使用"""
+    cas: str
+    name: str
+    location: str
+    stock: str
+    row: int
+    brands: Tuple[str, ...] = ()
+
+def split_brands(location: str) -> Tuple[str, ...]:
+    """把 'MATRIX、TCI'、'ACROS*3+LANCASTER' 這類欄位拆成個別廠牌 (統一大寫)"""
+    brands = []
+    for part in re.split(r'[、,+/&]', location):
+        brand = re.sub(r'\*\s*\d+', '', part).strip().upper()
+        if brand and brand != 'N/A' and brand not in brands:
+            brands.append(brand)
+    return tuple(brands)
+
+def normalize_name(name: str) -> str:
+    """名稱比對用：小寫、只留英數字，其餘符號視為空白"""
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', name.lower()).split())
+
+def name_trigrams(normalized: str) -> Set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
 class InventoryManager:
-    def __init__(self, csv_path: str):
+    def __init__(self, csv_path: str, use_snapshot: bool = USE_INVENTORY_SNAPSHOT,
+                 store: Optional["InventoryStore"] = None, cabinets: Optional[List[str]] = None):
+        """csv_path 為庫存 CSV；給了 store (inventory_store.InventoryStore) 時改從資料庫載入 cabinets 這幾櫃"""
         self.csv_path = csv_path
         self.csv_dir = os.path.dirname(csv_path)
+        # 多個鏡頭共用同一個盤點工作階段：已掃描集合、歷史與計數器的更新都要持有這把鎖
+        self._lock = threading.RLock()
         self.found_cas: Set[str] = set()
         self.found_names: Set[str] = set()
         
         # [新增] 歷史紀錄清單 (用於右側面板顯示)
         self.scan_history: List[Dict] = []
+        self.history_version = 0  # 歷史清單每次變動就 +1 (HUD 用來判斷要不要重畫)
         
+        # 原始表格 (欄位已對應成英文)，報告直接從這裡輸出
+        self.columns: List[str] = []
+        self.rows: List[Tuple[str, ...]] = []
+        self._df = None
+        self.loaded_from_snapshot = False
+        
+        start = time.perf_counter()
         try:
-            # 1. 讀取 CSV
-            self.df = pd.read_csv(csv_path, dtype={'CAS': str}, encoding='utf-8-sig')
-            
-            # 2. 清除標題空白
-            self.df.columns = self.df.columns.str.strip()
-            
-            # 3. 欄位對應
-            header_mapping = {
-                'CAS': 'CAS',
-                '上層藥品名稱': 'Name',
-                '廠牌': 'Location',
-                '數量': 'Stock'
-            }
-            self.df.rename(columns=header_mapping, inplace=True)
-            
-            # 4. 資料清理
-            if 'CAS' in self.df.columns:
-                self.df['CAS'] = self.df['CAS'].str.strip()
-            if 'Name' in self.df.columns:
-                self.df['Name'] = self.df['Name'].str.strip()
-                
-            self._name_list = self.df['Name'].tolist() if 'Name' in self.df.columns else []
-            self._name_to_cas = dict(zip(self.df['Name'].str.lower(), self.df['CAS'])) if 'Name' in self.df.columns else {}
-            self._cas_set = set(self.df['CAS'].tolist()) if 'CAS' in self.df.columns else set()
-            
-            print(f"[OK] 成功載入 {len(self.df)} 筆藥品資料。")
+            if store is not None:
+                self.columns, self.rows = store.inventory_table(cabinets)
+                self._build_index()
+            # 先找 CSV 旁邊的預先編譯快照，CSV 沒變就不必再 parse 與建索引
+            elif use_snapshot and self._load_snapshot():
+                self.loaded_from_snapshot = True
+            else:
+                self._load_csv()
+                self._build_index()
+                if use_snapshot:
+                    self._save_snapshot()
+            self.load_seconds = time.perf_counter() - start
+            source = "database" if store is not None else "snapshot" if self.loaded_from_snapshot else "CSV"
+            print(f"[OK] 成功載入 {self.total_count} 筆藥品資料。({source}, {self.load_seconds * 1000:.0f} ms)")
             
         except Exception as e:
             print(f"[ERROR] 讀取 CSV 失敗: {e}")
-            self.df = pd.DataFrame()
-            self._name_list = []
-            self._cas_set = set()
+            self.columns, self.rows = [], []
+            self._build_index()
+            self.load_seconds = time.perf_counter() - start
+        
+        self.load_catalog_files()
+        
+        # 盤點進度計數器：已掃描數在 _mark_found() 時遞增
+        self._counted_cas: Set[str] = set()
+        self._scanned_count = 0
+        self.location_found: Counter = Counter()
+        self.brand_found: Counter = Counter()
+        # 缺漏列也隨掃描遞減，產生缺漏報告時不必再掃過整份清單
+        self._missing_rows: Set[int] = set(range(len(self._records)))
+        
+        # 掃描日誌 (attach_journal() 之後才會寫入) 與資料庫的盤點工作階段
+        self.journal: Optional["ScanJournal"] = None
+        self.store_session = None
+        self._last_journaled: Dict[str, str] = {}  # 來源 -> 最後寫入日誌的 CAS
+
+    def _load_csv(self):
+        import pandas as pd  # 延遲載入：有快照時完全不需要 pandas
+        
+        # 1. 讀取 CSV
+        df = pd.read_csv(self.csv_path, dtype={'CAS': str}, encoding='utf-8-sig')
+        
+        # 2. 清除標題空白
+        df.columns = df.columns.str.strip()
+        
+        # 3. 欄位對應
+        df.rename(columns=INVENTORY_HEADER_MAPPING, inplace=True)
+        
+        # 4. 資料清理
+        if 'CAS' in df.columns:
+            df['CAS'] = df['CAS'].str.strip()
+        if 'Name' in df.columns:
+            df['Name'] = df['Name'].str.strip()
+        
+        # 空白欄位一律存成 ''
+        self.columns = [str(c) for c in df.columns]
+        self.rows = [tuple('' if pd.isna(v) else str(v) for v in row)
+                     for row in df.itertuples(index=False, name=None)]
+        self._df = df
+
+    @property
+    def df(self):
+        """pandas DataFrame (需要時才建立)"""
+        if self._df is None:
+            import pandas as pd
+            self._df = pd.DataFrame(self.rows, columns=self.columns)
+        return self._df
+
+    def _column(self, name: str, empty: str = 'N/A') -> List[str]:
+        if name not in self.columns: return [empty] * len(self.rows)
+        i = self.columns.index(name)
+        return [row[i] or empty for row in self.rows]
+
+    def _build_records(self):
+        """由原始表格建立紀錄與 CAS 索引 (很快，快照載入時也會重跑)"""
+        brands_of: Dict[str, Tuple[str, ...]] = {}  # 廠牌欄位重複率高，同樣的字串只拆一次
+        records = [
+            InventoryRecord(cas, name, location, stock, row,
+                            brands_of.get(location) or brands_of.setdefault(location, split_brands(location)))
+            for row, (cas, name, location, stock) in enumerate(
+                zip(self._column('CAS', ''), self._column('Name'), self._column('Location'), self._column('Stock')))
+        ]
+        
+        # 同一個 CAS 可能有多筆 (不同廠牌/位置)，全部保留
+        index: Dict[str, List[InventoryRecord]] = {}
+        for record in records:
+            if record.cas:
+                index.setdefault(record.cas, []).append(record)
+        self._records: Tuple[InventoryRecord, ...] = tuple(records)
+        self._cas_index: Dict[str, Tuple[InventoryRecord, ...]] = {k: tuple(v) for k, v in index.items()}
+        
+        has_names = 'Name' in self.columns
+        self._name_list = [r.name for r in records] if has_names else []
+        self._name_to_cas = {r.name.lower(): r.cas for r in records} if has_names else {}
+        self._cas_set = set(self._cas_index)
+        
+        # 條碼快速通道：庫存有型錄編號欄位時直接建對照表 (外部對照檔由 load_catalog_files() 補上)
+        self.catalog = CatalogIndex(known_cas=self._cas_set)
+        if 'Catalog' in self.columns:
+            for cas, catalog in zip(self._column('CAS', ''), self._column('Catalog', '')):
+                for code in _CODE_TOKEN_SPLIT.split(catalog):
+                    self.catalog.add(code, cas)
+        
+        # 盤點進度的分母 (各位置 / 廠牌的總數)
+        self.location_total: Counter = Counter(r.location for r in records if r.cas)
+        self.brand_total: Counter = Counter(b for r in records if r.cas for b in r.brands)
+
+    def _build_index(self):
+        """載入時一次建好 CAS -> 紀錄 索引，之後查詢都是 O(1) 的 dict 存取"""
+        self._build_records()
+        self._build_name_index(list(self._records) if 'Name' in self.columns else [])
+
+    # --- 預先編譯的庫存快照 (CSV 旁的 .snapshot 檔) ---
+
+    @property
+    def snapshot_path(self) -> str:
+        return self.csv_path + '.snapshot'
+
+    def _csv_fingerprint(self) -> Tuple[int, int]:
+        st = os.stat(self.csv_path)
+        return st.st_mtime_ns, st.st_size
+
+    def _csv_sha1(self) -> str:
+        with open(self.csv_path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def _load_snapshot(self) -> bool:
+        """
+        快照存在且 CSV 沒變 (mtime+大小相同，或內容雜湊相同) 時載入，回傳是否成功。
+        快照可能是別台電腦 (不同 Python / numpy 版本) 寫在共用磁碟上的：讀不進來就刪掉，
+        由呼叫端改讀 CSV 並重寫一份。
+        """
+        if not os.path.isfile(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snap = pickle.load(f)
+            if snap.get('version') != INVENTORY_SNAPSHOT_VERSION:
+                return False
+            touched = snap['fingerprint'] != self._csv_fingerprint()
+            # 只有 mtime 變了 (例如複製檔案) 但內容一樣時，仍可使用快照
+            if touched and snap['sha1'] != self._csv_sha1():
+                return False
+            
+            self.columns, self.rows = snap['columns'], snap['rows']
+            self._build_records()
+            self._name_keys = snap['name_keys']
+            self._name_records = [tuple(self._records[i] for i in rows) for rows in snap['name_record_rows']]
+            self._trigram_index = snap['trigram_index']
+            self._name_trigram_counts = snap['trigram_counts']
+        except Exception as e:
+            print(f"[WARN] 庫存快照無法使用，改讀 CSV: {type(e).__name__}: {e}")
+            try:
+                os.remove(self.snapshot_path)
+            except OSError:
+                pass
+            return False
+        
+        if touched:
+            self._save_snapshot()
+        return True
+
+    def _save_snapshot(self):
+        # 紀錄只存列號 (InventoryRecord 由 rows 重建)，避免 pickle 綁定模組路徑
+        snap = {
+            'version': INVENTORY_SNAPSHOT_VERSION,
+            'fingerprint': self._csv_fingerprint(),
+            'sha1': self._csv_sha1(),
+            'columns': self.columns,
+            'rows': self.rows,
+            'name_keys': self._name_keys,
+            'name_record_rows': [[r.row for r in records] for records in self._name_records],
+            'trigram_index': self._trigram_index,
+            'trigram_counts': self._name_trigram_counts,
+        }
+        tmp_path = self.snapshot_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(snap, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"[WARN] 無法寫入庫存快照: {e}")
+
+    def load_catalog_files(self):
+        """讀取 data/ 與庫存 CSV 旁的型錄對照檔 (供應商型錄編號 / GTIN -> CAS)"""
+        paths = [os.path.join(DATA_FOLDER, CATALOG_INDEX_FILENAME), os.path.join(self.csv_dir, CATALOG_INDEX_FILENAME)]
+        for path in dict.fromkeys(os.path.abspath(p) for p in paths):
+            if not os.path.isfile(path): continue
+            try:
+                added = self.catalog.load_csv(path)
+                print(f"[INFO] Catalog index: {added} codes from {path}")
+            except (OSError, csv.Error, UnicodeDecodeError) as e:
+                print(f"[WARN] 無法讀取型錄對照檔 {path}: {e}")
 
     @property
     def total_count(self) -> int:
-        return len(self.df)
+        return len(self.rows)
     
     @property
     def scanned_count(self) -> int:
-        all_found = self.found_cas.copy()
-        for name in self.found_names:
-            cas = self._name_to_cas.get(name.lower())
-            if cas: all_found.add(cas)
-        return len(all_found & self._cas_set)
+        return self._scanned_count
+
+    def location_progress(self, location: str) -> Tuple[int, int]:
+        return self.location_found[location], self.location_total[location]
+
+    def brand_progress(self, brand: str) -> Tuple[int, int]:
+        brand = brand.upper()
+        return self.brand_found[brand], self.brand_total[brand]
+
+    def _mark_found(self, cas_number: str):
+        """第一次掃到某個 CAS 時，更新所有進度計數器 (之後重複掃描不再計算)"""
+        if cas_number in self._counted_cas: return
+        records = self._cas_index.get(cas_number)
+        if not records: return
+        self._counted_cas.add(cas_number)
+        self._scanned_count += 1
+        for r in records:
+            self._missing_rows.discard(r.row)
+            self.location_found[r.location] += 1
+            for brand in r.brands:
+                self.brand_found[brand] += 1
 
-    def _add_to_history(self, info: dict):
+    def _add_found_name(self, name: str):
+        """以藥品名稱比對成功時記錄 (同樣會更新進度)"""
+        self.found_names.add(name)
+        cas = self._name_to_cas.get(name.lower())
+        if cas: self._mark_found(cas)
+
+    def _add_to_history(self, info: dict, when: Optional[datetime] = None):
         """[新增] 將掃描到的物品加入歷史清單"""
         # 防止重複：如果最新的一筆跟現在這筆一樣，就不加
         if not self.scan_history or self.scan_history[-1]['CAS'] != info['CAS']:
             display_item = {
                 'CAS': info['CAS'],
                 'Brand': info.get('Location', 'N/A'), # 顯示廠牌比較不會亂碼
-                'Time': datetime.now().strftime("%H:%M:%S")
+                'Time': (when or datetime.now()).strftime("%H:%M:%S")
             }
             self.scan_history.append(display_item)
             # 只保留最後 8 筆
             if len(self.scan_history) > 8:
                 self.scan_history.pop(0)
+            self.history_version += 1
 
-    def lookup(self, cas_number: str) -> Optional[dict]:
-        """查詢藥品並加入歷史"""
-        if self.df.empty: return None
-        result = self.df[self.df['CAS'] == cas_number]
-        
-        if len(result) > 0:
-            self.found_cas.add(cas_number)
-            row = result.iloc[0]
-            info = {
-                'CAS': row['CAS'],
-                'Name': row['Name'],
-                'Location': row.get('Location', 'N/A'),
-                'Stock': row.get('Stock', 'N/A'),
-                'match_type': 'cas'
-            }
-            self._add_to_history(info) # 加入歷史
+    def lookup_all(self, cas_number: str) -> Tuple[InventoryRecord, ...]:
+        """回傳該 CAS 的所有庫存紀錄 (不記錄為已掃描)"""
+        return self._cas_index.get(cas_number, ())
+
+    def _make_info(self, records: Tuple[InventoryRecord, ...], match_type: str) -> dict:
+        first = records[0]
+        # 重複的 CAS：合併顯示所有廠牌/位置
+        locations = list(dict.fromkeys(r.location for r in records))
+        return {
+            'CAS': first.cas,
+            'Name': first.name,
+            'Location': ' / '.join(locations),
+            'Stock': ' / '.join(r.stock for r in records),
+            'Locations': locations,
+            'records': records,
+            'match_type': match_type
+        }
+
+    def lookup(self, cas_number: str, source: str = '',
+               confidence: Optional[float] = None, match_type: str = 'cas') -> Optional[dict]:
+        """查詢藥品並加入歷史 (source / confidence 只用於掃描日誌；條碼讀到的 match_type 為 'barcode')"""
+        records = self._cas_index.get(cas_number)
+        
+        if records:
+            info = self._make_info(records, match_type)
+            with self._lock:
+                self.found_cas.add(cas_number)
+                self._mark_found(cas_number)
+                self._add_to_history(info) # 加入歷史
+                self._record_scan(info, source, confidence)
             return info
         return None
 
-    def fuzzy_match_name(self, text: str, threshold: int = 80) -> Optional[Dict]:
-        # (簡化的模糊比對邏輯，為了保持程式碼簡潔，這裡主要依賴 CAS)
-        # 如果需要名字比對功能，可以保留原本的邏輯
-        if not self._name_list or not text.strip(): return None
-        # 這裡為了流暢度先略過複雜的名字比對，專注於 CAS 掃描
-        return None
+    def _record_scan(self, info: dict, source: str, confidence: Optional[float]):
+        """寫入掃描日誌 / 資料庫 (呼叫端必須持有 self._lock)；同一個來源連續讀到同一瓶只記一次"""
+        if self.journal is None and self.store_session is None:
+            return
+        if self._last_journaled.get(source) == info['CAS']:
+            return
+        self._last_journaled[source] = info['CAS']
+        entry = {'time': datetime.now().isoformat(timespec='seconds'), 'cas': info['CAS'],
+                 'source': source, 'match': info['match_type'],
+                 'confidence': None if confidence is None else round(float(confidence), 1)}
+        if info['match_type'] == 'name':
+            entry['name'] = info['Name']
+        if self.journal is not None:
+            self.journal.append(entry)
+        if self.store_session is not None:
+            self.store_session.record(entry)
 
-    def generate_report(self) -> str:
-        all_found = self.found_cas.copy()
-        for name in self.found_names:
-            cas = self._name_to_cas.get(name.lower())
-            if cas: all_found.add(cas)
-            
-        missing = self.df[~self.df['CAS'].isin(all_found)]
+    def attach_journal(self, journal: "ScanJournal") -> int:
+        """開始寫入掃描日誌；若日誌是上次沒正常結束的盤點，先重播已掃描的紀錄，回傳重播筆數"""
+        entries = journal.open()
+        with self._lock:
+            self.replay_scans(entries)
+            self.journal = journal
+        return len(entries)
+
+    def attach_store_session(self, session) -> int:
+        """掃描結果同時寫入資料庫的盤點工作階段；接續未結束的工作階段時先重播它的紀錄"""
+        entries = session.scans()
+        with self._lock:
+            self.replay_scans(entries)
+            self.store_session = session
+        return len(entries)
+
+    def replay_scans(self, entries: List[dict]):
+        """把日誌格式的掃描紀錄 ({'cas', 'match', 'name', 'time', 'source'}) 套用到已掃描狀態 (不再寫回日誌)"""
+        with self._lock:
+            for entry in entries:
+                cas = entry.get('cas')
+                # 接續後同一個鏡頭還對著同一瓶時不要再寫一次
+                if entry.get('source') is not None:
+                    self._last_journaled[entry['source']] = cas
+                records = self._cas_index.get(cas)
+                if not records: continue
+                if entry.get('match') == 'name':
+                    self._add_found_name(entry.get('name') or records[0].name)
+                else:
+                    self.found_cas.add(cas)
+                self._mark_found(cas)
+                try:
+                    when = datetime.fromisoformat(entry['time'])
+                except (KeyError, TypeError, ValueError):
+                    when = None
+                self._add_to_history(self._make_info(records, entry.get('match', 'cas')), when)
+
+    def history_snapshot(self) -> Tuple[int, List[Dict]]:
+        """一次取得 (版本, 歷史清單複本)，避免其他鏡頭的執行緒正在寫入時讀到一半"""
+        with self._lock:
+            return self.history_version, list(self.scan_history)
+
+    def _build_name_index(self, records: List[InventoryRecord]):
+        """名稱的字元 trigram 倒排索引：trigram -> 含有它的名稱編號 (載入時建一次)"""
+        grouped: Dict[str, List[InventoryRecord]] = {}
+        for record in records:
+            key = normalize_name(record.name)
+            if key and record.name != 'N/A':
+                grouped.setdefault(key, []).append(record)
+        self._name_keys: List[str] = list(grouped)
+        self._name_records: List[Tuple[InventoryRecord, ...]] = [tuple(v) for v in grouped.values()]
+        
+        index: Dict[str, List[int]] = {}
+        counts = []
+        for name_id, key in enumerate(self._name_keys):
+            grams = name_trigrams(key)
+            counts.append(len(grams))
+            for gram in grams:
+                index.setdefault(gram, []).append(name_id)
+        # posting list 存成 numpy 陣列，查詢時用 bincount 一次算出所有名稱的重疊數
+        self._trigram_index = {g: np.asarray(ids, dtype=np.int32) for g, ids in index.items()}
+        self._name_trigram_counts = np.asarray(counts, dtype=np.float32)
+
+    def _shortlist_names(self, query: str, limit: int) -> List[int]:
+        """用 trigram 重疊數 (Dice 係數) 挑出最可能的幾個名稱，不必掃過整份清單"""
+        grams = name_trigrams(query)
+        postings = [self._trigram_index[g] for g in grams if g in self._trigram_index]
+        if not postings: return []
+        shared = np.bincount(np.concatenate(postings), minlength=len(self._name_keys))
+        dice = 2.0 * shared / (len(grams) + self._name_trigram_counts)
+        dice[shared < 2] = 0.0
+        if limit < len(dice):
+            top = np.argpartition(dice, -limit)[-limit:]
+        else:
+            top = np.arange(len(dice))
+        top = top[np.argsort(dice[top])[::-1]]
+        return [int(i) for i in top if dice[i] > 0]
+
+    def fuzzy_match_name(self, text: str, threshold: int = NAME_MATCH_THRESHOLD,
+                         source: str = '') -> Optional[Dict]:
+        """
+        CAS 讀不到時用藥品名稱比對：OCR 文字逐行查 trigram 索引取得候選，
+        只對候選做 fuzz.ratio 評分，找到就記錄為已掃描並加入歷史。
+        """
+        if not self._name_keys or not text.strip(): return None
+        from thefuzz import fuzz  # 延遲載入 (只有走到名稱比對才需要)
+        
+        best_score, best_id = 0, -1
+        for line in text.splitlines():
+            query = normalize_name(line)
+            # 太短或幾乎都是數字 (CAS、批號) 的行不用比
+            if len(query) < 5 or sum(c.isalpha() for c in query) < 4:
+                continue
+            for name_id in self._shortlist_names(query, NAME_MATCH_SHORTLIST):
+                score = fuzz.ratio(query, self._name_keys[name_id])
+                if score > best_score:
+                    best_score, best_id = score, name_id
+        
+        if best_id < 0 or best_score < threshold: return None
+        records = self._name_records[best_id]
+        info = self._make_info(records, 'name')
+        info['score'] = best_score
+        with self._lock:
+            self._add_found_name(records[0].name)
+            self._add_to_history(info)
+            self._record_scan(info, source, best_score)
+        return info
+
+    def generate_report(self, output_dir: Optional[str] = None) -> str:
+        """缺漏報告 (預設存到 data 資料夾)"""
+        # 缺漏列在掃描 (或重播日誌) 時已逐筆扣除，這裡只需要排序輸出
+        with self._lock:
+            missing_rows = sorted(self._missing_rows)
+        return self._write_rows(missing_rows, "missing_report", output_dir)
+
+    def generate_found_report(self, output_dir: Optional[str] = None) -> str:
+        """已掃到的藥品清單"""
+        with self._lock:
+            all_found = set(self._counted_cas)
+        found_rows = [r.row for r in self._records if r.cas in all_found]
+        return self._write_rows(found_rows, "found_report", output_dir)
+
+    def _write_rows(self, rows: List[int], prefix: str, output_dir: Optional[str]) -> str:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-        filename = f"missing_report_{timestamp}.csv"
+        filename = f"{prefix}_{timestamp}.csv"
         # 報告存到 data 資料夾
-        path = os.path.join(DATA_FOLDER, filename)
-        missing.to_csv(path, index=False, encoding='utf-8-sig')
+        output_dir = output_dir or DATA_FOLDER
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, filename)
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            writer.writerows(self.rows[i] for i in rows)
         return path
 
+# =============================================================================
+# SCAN JOURNAL (掃描日誌 / 當機復原)
+# =============================================================================
+
+def journal_path_for(csv_path: str) -> str:
+    return csv_path + '.journal.jsonl'
+
+class ScanJournal:
+    """
+    只會附加的掃描日誌 (JSON Lines)：第一行是 session 標頭，之後每筆確認的掃描一行，
+    正常結束時寫入 end。寫入先進緩衝區，累積 flush_every 筆或隔 flush_seconds 秒
+    (背景執行緒) 才 fsync 一次，當機時最多遺失最後一批。
+    沒有 end 的日誌代表上次盤點沒正常結束，open() 會接續它；已結束的則移到 data 資料夾封存。
+    """
+
+    def __init__(self, path: str, flush_every: int = JOURNAL_FLUSH_EVERY,
+                 flush_seconds: float = JOURNAL_FLUSH_SECONDS):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._file = None
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self.written = 0
+        self.syncs = 0
+
+    @staticmethod
+    def read(path: str) -> List[dict]:
+        """讀取日誌 (當機時最後一行可能只寫了一半，解析失敗的行直接略過)"""
+        entries = []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+        return entries
+
+    def _archive(self, header: dict):
+        started = header.get('started', '').replace(':', '').replace('-', '').replace('T', '_')
+        os.makedirs(DATA_FOLDER, exist_ok=True)
+        # 開始時間只到秒：同一秒開始的盤點 (或沒有標頭的日誌) 加上序號，不要互相覆蓋
+        base = os.path.join(DATA_FOLDER, f"scan_journal_{started or 'unknown'}")
+        archive_path = base + '.jsonl'
+        n = 1
+        while os.path.exists(archive_path):
+            n += 1
+            archive_path = f"{base}_{n}.jsonl"
+        os.replace(self.path, archive_path)
+
+    def open(self) -> List[dict]:
+        """開啟日誌並回傳要接續的掃描紀錄 (新的盤點回傳空清單)"""
+        entries = self.read(self.path)
+        scans = [e for e in entries if 'cas' in e]
+        header = next((e for e in entries if e.get('type') == 'session'), None)
+        if entries and (header is None or entries[-1].get('type') == 'end'):
+            self._archive(header or {})
+            entries, scans = [], []
+        
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if not entries:
+            self.append({'type': 'session', 'started': datetime.now().isoformat(timespec='seconds'),
+                         'inventory': os.path.basename(self.path).replace('.journal.jsonl', '')})
+        self._flusher = threading.Thread(target=self._flush_loop, name='journal', daemon=True)
+        self._flusher.start()
+        return scans
+
+    def append(self, entry: dict):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.written += 1
+            self._dirty += 1
+            if self._dirty >= self.flush_every:
+                self._sync()
+
+    def _sync(self):
+        # 呼叫端必須持有 self._lock
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._dirty = 0
+        self.syncs += 1
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None and self._dirty:
+                self._sync()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+
+    def close(self, ended: bool = True):
+        """ended=True 表示盤點正常結束 (下次啟動會開新的盤點)"""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        if ended:
+            self.append({'type': 'end', 'ended': datetime.now().isoformat(timespec='seconds')})
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+# =============================================================================
+# TELEMETRY (各階段耗時統計)
+# =============================================================================
+
+class RollingHistogram:
+    """固定大小的環狀樣本緩衝區：add() 只寫一個位置，百分位數在讀取時才計算"""
+
+    def __init__(self, size: int = METRICS_WINDOW):
+        self._samples = np.zeros(size, np.float64)
+        self._next = 0
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, value: float):
+        with self._lock:
+            self._samples[self._next] = value
+            self._next = (self._next + 1) % len(self._samples)
+            self.count += 1
+            self.total += value
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            samples = self._samples[:min(self.count, len(self._samples))].copy()
+            count, total = self.count, self.total
+        if not len(samples):
+            return {'count': 0, 'sum': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'mean': 0.0}
+        p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+        return {'count': count, 'sum': total, 'p50': float(p50), 'p95': float(p95),
+                'p99': float(p99), 'mean': float(samples.mean())}
+
+class Metrics:
+    """
+    各階段耗時 (秒) 的滾動直方圖與即時數值 (gauge)。
+    gauge 由 add_collector() 註冊的函式在 snapshot() 時才更新 (報告執行緒 / HTTP 執行緒)，
+    不增加掃描迴圈的負擔；HUD 用的 summary_lines() 只讀階段耗時，不跑 collector。
+    """
+
+    def __init__(self, enabled: bool = ENABLE_METRICS, window: int = METRICS_WINDOW):
+        self.enabled = enabled
+        self.window = window
+        self._stages: Dict[str, RollingHistogram] = {}
+        self._gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._collectors: List = []
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        if not self.enabled: return
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self._stages.setdefault(stage, RollingHistogram(self.window))
+        histogram.add(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = float(value)
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def stage_summaries(self) -> Dict[str, Dict[str, float]]:
+        """{階段: 統計 (秒)}"""
+        with self._lock:
+            stages = dict(self._stages)
+        return {name: h.summary() for name, h in sorted(stages.items())}
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """{'stages': {階段: 統計 (秒)}, 'gauges': [{name, labels, value}]}"""
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:  # collector 會呼叫 set_gauge()，不能在持有鎖時執行
+            collector(self)
+        with self._lock:
+            gauges = sorted(self._gauges.items())
+        return {
+            'stages': self.stage_summaries(),
+            'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                       for (name, labels), value in gauges],
+        }
+
+    def prometheus_text(self) -> str:
+        """Prometheus text exposition format"""
+        snap = self.snapshot()
+        host = socket.gethostname()
+        lines = ["# HELP labscanner_stage_seconds Scan loop stage latency (rolling window).",
+                 "# TYPE labscanner_stage_seconds summary"]
+        for stage, st in snap['stages'].items():
+            labels = f'host="{host}",stage="{stage}"'
+            for q, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                lines.append(f'labscanner_stage_seconds{{{labels},quantile="{q}"}} {st[key]:.6f}')
+            lines.append(f'labscanner_stage_seconds_sum{{{labels}}} {st["sum"]:.6f}')
+            lines.append(f'labscanner_stage_seconds_count{{{labels}}} {st["count"]}')
+        declared = set()
+        for gauge in snap['gauges']:
+            name = f"labscanner_{gauge['name']}"
+            if name not in declared:
+                lines.append(f"# TYPE {name} gauge")
+                declared.add(name)
+            labels = ','.join([f'host="{host}"'] + [f'{k}="{v}"' for k, v in gauge['labels'].items()])
+            lines.append(f"{name}{{{labels}}} {gauge['value']:g}")
+        return "\n".join(lines) + "\n"
+
+    def summary_lines(self, stages: Optional[List[str]] = None) -> List[str]:
+        """除錯 HUD / 主控台用的表格 (毫秒)"""
+        snap = self.stage_summaries()
+        lines = [f"{'stage':<15}{'p50':>7}{'p95':>7}{'p99':>7}"]
+        for stage in stages or list(snap):
+            st = snap.get(stage)
+            if st and st['count']:
+                lines.append(f"{stage:<15}{st['p50'] * 1000:7.1f}{st['p95'] * 1000:7.1f}{st['p99'] * 1000:7.1f}")
+        return lines
+
+METRICS = Metrics()
+
+# OCR 工作 (執行緒或子行程) 內的各階段耗時先記在這裡，隨 OCRResult 帶回主行程再寫入 METRICS
+_job_timings = threading.local()
+
+@contextmanager
+def job_stage(stage: str):
+    timings = getattr(_job_timings, 'current', None)
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+class MetricsReporter:
+    """背景執行緒：定期把 METRICS 寫成 JSON (最新一份) 與 CSV (累加)，並可提供 /metrics HTTP 端點"""
+
+    def __init__(self, metrics: Metrics, interval: float = METRICS_DUMP_SECONDS,
+                 http_port: Optional[int] = METRICS_HTTP_PORT, output_dir: Optional[str] = None):
+        self.metrics = metrics
+        self.interval = interval
+        self.http_port = http_port
+        self.output_dir = output_dir or DATA_FOLDER
+        self.host = socket.gethostname()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._server = None
+
+    @property
+    def json_path(self) -> str:
+        return os.path.join(self.output_dir, f"metrics_{self.host}.json")
+
+    @property
+    def csv_path(self) -> str:
+        return os.path.join(self.output_dir, f"metrics_{self.host}_{datetime.now():%Y%m%d}.csv")
+
+    def start(self):
+        if self.http_port:
+            self._start_http()
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._loop, name='metrics', daemon=True)
+            self._thread.start()
+
+    def _start_http(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # 不要每次抓取都印在主控台
+
+        try:
+            self._server = ThreadingHTTPServer(('127.0.0.1', self.http_port), Handler)
+        except OSError as e:
+            print(f"[WARN] Metrics endpoint unavailable on port {self.http_port}: {e}")
+            return
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        print(f"[INFO] Metrics endpoint: http://127.0.0.1:{self.http_port}/metrics")
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        snap = self.metrics.snapshot()
+        now = datetime.now().isoformat(timespec='seconds')
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            tmp_path = self.json_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'time': now, 'host': self.host, **snap}, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.json_path)
+            
+            csv_path = self.csv_path
+            new_file = not os.path.exists(csv_path)
+            with open(csv_path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(['time', 'host', 'stage', 'count', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms'])
+                for stage, st in snap['stages'].items():
+                    writer.writerow([now, self.host, stage, st['count']] +
+                                    [f"{st[k] * 1000:.2f}" for k in ('p50', 'p95', 'p99', 'mean')])
+        except OSError as e:
+            print(f"[WARN] 無法寫入效能統計: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.dump()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
 # =============================================================================
 # OCR ENGINE
 # =============================================================================
 
-def perform_ocr(image: np.ndarray) -> str:
+_tesseract_cmd = TESSERACT_PATH
+
+def set_tesseract_cmd(cmd: str):
+    """設定 tesseract 執行檔路徑 (pytesseract 延遲載入，路徑先記在這裡)"""
+    global _tesseract_cmd
+    _tesseract_cmd = cmd
+
+def get_tesseract_cmd() -> str:
+    return _tesseract_cmd
+
+class OCRLine(NamedTuple):
+    text: str
+    confidence: float  # 該行各字信心度的最小值 (0~100)
+
+def join_lines(lines: List[OCRLine]) -> str:
+    return "\n".join(line.text for line in lines)
+
+class OCRBackend:
+    """OCR 後端介面：recognize() 接收 numpy 影像與 Tesseract 風格的參數字串"""
+    name = 'base'
+    batched = False  # True = recognize_batch() 一次處理多張比逐張呼叫快 (ROI 流程會整批送出)
+    binary_input = True  # False = 送灰階影像而不是二值化結果 (CRNN 模型是用灰階訓練的，二值化只會丟掉筆畫邊緣)
+
+    def recognize(self, image: np.ndarray, config: str) -> str:
+        raise NotImplementedError
+
+    def recognize_lines(self, image: np.ndarray, config: str) -> List[OCRLine]:
+        """逐行結果與信心度；不提供信心度的後端一律視為 100"""
+        return [OCRLine(line.strip(), 100.0) for line in self.recognize(image, config).splitlines() if line.strip()]
+
+    def recognize_batch(self, images: List[np.ndarray], config: str) -> List[List[OCRLine]]:
+        """多張影像各自的 recognize_lines() 結果"""
+        return [self.recognize_lines(image, config) for image in images]
+
+    def close(self):
+        pass
+
+class PytesseractBackend(OCRBackend):
+    """原本的做法：每次呼叫都寫暫存檔並啟動 tesseract 執行檔 (相容性最好，作為備援)"""
+    name = 'pytesseract'
+
+    def __init__(self):
+        import pytesseract
+        self._pytesseract = pytesseract
+
+    def recognize(self, image: np.ndarray, config: str) -> str:
+        self._pytesseract.pytesseract.tesseract_cmd = get_tesseract_cmd()
+        return self._pytesseract.image_to_string(image, config=config)
+
+    def recognize_lines(self, image: np.ndarray, config: str) -> List[OCRLine]:
+        # image_to_data 跟 image_to_string 一樣只跑一次 tesseract，但多了每個字的信心度
+        self._pytesseract.pytesseract.tesseract_cmd = get_tesseract_cmd()
+        data = self._pytesseract.image_to_data(image, config=config,
+                                               output_type=self._pytesseract.Output.DICT)
+        grouped: "OrderedDict[tuple, List[Tuple[str, float]]]" = OrderedDict()
+        for i, word in enumerate(data['text']):
+            conf = float(data['conf'][i])
+            if conf < 0 or not word.strip():  # -1 = 區塊/段落等非文字層級
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            grouped.setdefault(key, []).append((word, conf))
+        return [OCRLine(' '.join(w for w, _ in words), min(c for _, c in words))
+                for words in grouped.values()]
+
+def parse_tesseract_config(config: str) -> Tuple[int, int, Dict[str, str]]:
+    """把 '--oem 3 --psm 7 -c key=value' 拆成 (oem, psm, variables)"""
+    oem, psm, variables = 3, 3, {}
+    tokens = config.split()
+    for i, token in enumerate(tokens[:-1]):
+        if token == '--oem': oem = int(tokens[i + 1])
+        elif token == '--psm': psm = int(tokens[i + 1])
+        elif token == '-c' and '=' in tokens[i + 1]:
+            key, value = tokens[i + 1].split('=', 1)
+            variables[key] = value
+    return oem, psm, variables
+
+class TesserocrBackend(OCRBackend):
+    """
+    常駐的 Tesseract API (tesserocr)：每個執行緒一個 handle，語言模型只載入一次，
+    影像直接從 numpy buffer 傳入，不寫暫存檔、不開子行程。
+    """
+    name = 'tesserocr'
+
+    def __init__(self, tessdata_path: Optional[str] = None, lang: str = 'eng'):
+        import tesserocr  # 選用套件，未安裝時由 create_ocr_backend() 退回 pytesseract
+        self._tesserocr = tesserocr
+        self.tessdata_path = tessdata_path
+        self.lang = lang
+        self._local = threading.local()
+        self._apis: List = []
+        self._lock = threading.Lock()
+        # 先建立一個 handle：tessdata 找不到、語言檔缺少時在這裡就失敗，'auto' 才會退回 pytesseract
+        self._get_api(parse_tesseract_config(OCR_CONFIG)[0])
+
+    def _get_api(self, oem: int):
+        apis = getattr(self._local, 'apis', None)
+        if apis is None:
+            apis = self._local.apis = {}
+        api = apis.get(oem)
+        if api is None:
+            kwargs = {'lang': self.lang, 'oem': oem}
+            if self.tessdata_path:
+                kwargs['path'] = self.tessdata_path
+            api = apis[oem] = self._tesserocr.PyTessBaseAPI(**kwargs)
+            with self._lock:
+                self._apis.append(api)
+        return api
+
+    def _set_image(self, image: np.ndarray, config: str):
+        oem, psm, variables = parse_tesseract_config(config)
+        api = self._get_api(oem)
+        api.SetPageSegMode(psm)
+        # 變數會留在 handle 上，沒指定白名單時要清掉上一次的設定
+        api.SetVariable('tessedit_char_whitelist', variables.pop('tessedit_char_whitelist', ''))
+        for key, value in variables.items():
+            api.SetVariable(key, value)
+        
+        image = np.ascontiguousarray(image)
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        h, w = image.shape[:2]
+        bpp = 1 if image.ndim == 2 else image.shape[2]
+        api.SetImageBytes(image.tobytes(), w, h, bpp, w * bpp)
+        return api
+
+    def recognize(self, image: np.ndarray, config: str) -> str:
+        return self._set_image(image, config).GetUTF8Text()
+
+    def recognize_lines(self, image: np.ndarray, config: str) -> List[OCRLine]:
+        api = self._set_image(image, config)
+        api.Recognize()
+        tesserocr = self._tesserocr
+        level = tesserocr.RIL.WORD
+        lines, words = [], []
+        iterator = api.GetIterator()
+        if iterator is None:
+            return lines
+        for item in tesserocr.iterate_level(iterator, level):
+            try:
+                word = item.GetUTF8Text(level)
+            except RuntimeError:  # 沒有文字的元素 (空白畫面)
+                word = ''
+            if word and word.strip():
+                words.append((word.strip(), item.Confidence(level)))
+            if words and item.IsAtFinalElement(tesserocr.RIL.TEXTLINE, level):
+                lines.append(OCRLine(' '.join(w for w, _ in words), min(c for _, c in words)))
+                words = []
+        if words:
+            lines.append(OCRLine(' '.join(w for w, _ in words), min(c for _, c in words)))
+        return lines
+
+    def close(self):
+        with self._lock:
+            for api in self._apis:
+                api.End()
+            self._apis.clear()
+
+def split_text_lines(image: np.ndarray, min_height: int = 6) -> List[np.ndarray]:
+    """把多行的文字區塊 (黑字白底，二值化或灰階) 依水平投影切成單行影像"""
+    h, w = image.shape[:2]
+    # Otsu 門檻：二值化影像照舊，灰階影像也能分出墨跡
+    _, ink = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    ink_rows = np.count_nonzero(ink, axis=1) > max(1, w // 100)
+    return [image[max(0, y0 - 2):min(h, y1 + 2)] for y0, y1 in text_line_spans(ink_rows, min_height)]
+
+class OnnxCRNNBackend(OCRBackend):
+    """
+    CRNN 文字辨識模型 (例如 PaddleOCR PP-OCR 辨識模型匯出成 ONNX)，用 ONNX Runtime 在 CPU 上執行。
+    - 模型一次只讀一行：單行區塊 (--psm 7/8/13) 直接辨識，其餘先用水平投影切成多行
+    - 多個區塊依寬高比排序後整批推論 (recognize_batch)，減少補白與呼叫次數
+    - Tesseract 的字元白名單 (-c tessedit_char_whitelist=...) 以遮蔽輸出類別的方式支援
+    - CTC greedy 解碼，信心度 = 保留字元機率的平均 (0~100)
+    - 輸入灰階影像 (binary_input = False)：模型以灰階訓練，二值化後的鋸齒筆畫反而讀錯
+    - 只有辨識、沒有文字偵測：要搭配 ROI 模式 (OCR_USE_ROI = True)，整張畫面切不出乾淨的單行
+    """
+    name = 'onnx'
+    batched = True
+    binary_input = False
+    SINGLE_LINE_PSM = (7, 8, 13)
+
+    def __init__(self, model_path: str = ONNX_REC_MODEL, charset_path: str = ONNX_REC_CHARSET,
+                 input_height: int = ONNX_REC_HEIGHT, max_width: int = ONNX_REC_MAX_WIDTH,
+                 batch_size: int = ONNX_REC_BATCH_SIZE, threads: int = ONNX_THREADS):
+        import onnxruntime  # 選用套件，只有 OCR_BACKEND = 'onnx' 時才需要
+        if not os.path.isfile(model_path):
+            raise FileNotFoundError(f"ONNX recognition model not found: {model_path}")
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        # 固定輸入寬度的模型要補白到該寬度；動態寬度則補到同一批中最寬的那張
+        fixed_width = model_input.shape[3] if len(model_input.shape) == 4 else None
+        self.fixed_width = fixed_width if isinstance(fixed_width, int) else None
+        self.input_height = input_height
+        self.max_width = self.fixed_width or max_width
+        self.batch_size = max(1, batch_size)
+
+        # 類別 0 = CTC blank，之後依字典檔順序；PP-OCR 字典沒有空白字元，模型最後一類是空白
+        # 沒有字典檔時改用模型內嵌的字典 (RapidOCR 等轉出的 PP-OCR 模型 metadata 'character')
+        if os.path.isfile(charset_path):
+            with open(charset_path, encoding='utf-8') as f:
+                characters = f.read().splitlines()
+        else:
+            characters = self._session.get_modelmeta().custom_metadata_map.get('character', '').splitlines()
+            if not characters:
+                raise FileNotFoundError(f"ONNX recognition charset not found: {charset_path}")
+        self.charset = [''] + [c for c in characters if c]
+        self._whitelist_masks: Dict[str, np.ndarray] = {}
+
+    def _classes(self, num_classes: int) -> List[str]:
+        if len(self.charset) < num_classes:
+            self.charset += [' '] * (num_classes - len(self.charset))
+        return self.charset
+
+    def _whitelist_mask(self, whitelist: str, num_classes: int) -> np.ndarray:
+        mask = self._whitelist_masks.get(whitelist)
+        if mask is None or mask.size != num_classes:
+            classes = self._classes(num_classes)
+            mask = np.array([i == 0 or classes[i] in whitelist for i in range(num_classes)])
+            self._whitelist_masks[whitelist] = mask
+        return mask
+
+    def _prepare(self, images: List[np.ndarray]) -> np.ndarray:
+        """縮放到模型高度 (保持寬高比)，正規化到 [-1, 1]，補白成 (N, 3, H, W) 的一批"""
+        h = self.input_height
+        widths = [min(self.max_width, max(h // 2, round(img.shape[1] * h / max(1, img.shape[0]))))
+                  for img in images]
+        batch_width = self.fixed_width or max(widths)
+        batch = np.zeros((len(images), 3, h, batch_width), np.float32)
+        for i, (img, w) in enumerate(zip(images, widths)):
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+            resized = cv2.resize(gray, (w, h), interpolation=cv2.INTER_LINEAR).astype(np.float32)
+            batch[i, :, :, :w] = resized / 127.5 - 1.0
+        return batch
+
+    def _decode(self, probs: np.ndarray, whitelist: str) -> List[OCRLine]:
+        """CTC greedy 解碼：每個時間步取最高分的類別，合併連續重複並去掉 blank"""
+        if not np.allclose(probs[0].sum(axis=-1), 1.0, atol=1e-2):  # 有些匯出的模型沒有最後的 softmax
+            probs = np.exp(probs - probs.max(axis=-1, keepdims=True))
+            probs /= probs.sum(axis=-1, keepdims=True)
+        classes = self._classes(probs.shape[-1])
+        if whitelist:
+            probs = np.where(self._whitelist_mask(whitelist, probs.shape[-1]), probs, 0.0)
+        best = probs.argmax(axis=-1)
+        scores = probs.max(axis=-1)
+        lines = []
+        for index, score in zip(best, scores):
+            keep = (index != 0) & np.append(True, index[1:] != index[:-1])
+            text = ''.join(classes[i] for i in index[keep]).strip()
+            lines.append(OCRLine(text, float(score[keep].mean() * 100) if text else 0.0))
+        return lines
+
+    def _recognize_crops(self, crops: List[np.ndarray], whitelist: str) -> List[OCRLine]:
+        results: List[Optional[OCRLine]] = [None] * len(crops)
+        # 寬高比相近的放同一批，補白最少
+        order = sorted(range(len(crops)), key=lambda i: crops[i].shape[1] / max(1, crops[i].shape[0]))
+        for start in range(0, len(order), self.batch_size):
+            chunk = order[start:start + self.batch_size]
+            probs = self._session.run(None, {self._input_name: self._prepare([crops[i] for i in chunk])})[0]
+            for i, line in zip(chunk, self._decode(probs, whitelist)):
+                results[i] = line
+        return results
+
+    def recognize_batch(self, images: List[np.ndarray], config: str) -> List[List[OCRLine]]:
+        _, psm, variables = parse_tesseract_config(config)
+        whitelist = variables.get('tessedit_char_whitelist', '')
+        # 所有區塊的所有行攤平成一批推論，再依來源區塊分回去
+        crops, owners = [], []
+        for i, image in enumerate(images):
+            lines = [image] if psm in self.SINGLE_LINE_PSM else split_text_lines(image)
+            crops.extend(lines)
+            owners.extend([i] * len(lines))
+        results: List[List[OCRLine]] = [[] for _ in images]
+        if crops:
+            for owner, line in zip(owners, self._recognize_crops(crops, whitelist)):
+                if line.text:
+                    results[owner].append(line)
+        return results
+
+    def recognize_lines(self, image: np.ndarray, config: str) -> List[OCRLine]:
+        return self.recognize_batch([image], config)[0]
+
+    def recognize(self, image: np.ndarray, config: str) -> str:
+        return join_lines(self.recognize_lines(image, config))
+
+def default_tessdata_path() -> Optional[str]:
+    """Windows 安裝版的 tessdata 放在 tesseract.exe 旁邊"""
+    folder = os.path.dirname(get_tesseract_cmd())
+    if not folder:  # 只有指令名稱 (在 PATH 上)：交給 tesserocr 自己找 (TESSDATA_PREFIX 或編譯時的預設路徑)
+        return None
+    path = os.path.join(folder, 'tessdata')
+    return path if os.path.isdir(path) else None
+
+def create_ocr_backend(name: str = OCR_BACKEND) -> OCRBackend:
+    """依名稱建立後端；'auto' 會優先使用常駐引擎，裝不起來就退回 pytesseract"""
+    if name == 'onnx':
+        if not OCR_USE_ROI:
+            print("[WARN] The ONNX backend only reads single text lines; full-frame OCR (OCR_USE_ROI = False) will find nothing.")
+        return OnnxCRNNBackend()
+    if name in ('auto', 'tesserocr'):
+        try:
+            return TesserocrBackend(default_tessdata_path())
+        except Exception as e:
+            if name == 'tesserocr':
+                raise
+            print(f"[WARN] tesserocr unavailable ({e}), falling back to pytesseract.")
+    if name in ('auto', 'pytesseract'):
+        return PytesseractBackend()
+    raise ValueError(f"Unknown OCR backend: {name}")
+
+_ocr_backend: Optional[OCRBackend] = None
+_ocr_backend_lock = threading.Lock()
+
+def get_ocr_backend() -> OCRBackend:
+    """目前使用的後端 (每個行程第一次呼叫時建立)"""
+    global _ocr_backend
+    if _ocr_backend is None:
+        with _ocr_backend_lock:
+            if _ocr_backend is None:
+                _ocr_backend = create_ocr_backend()
+    return _ocr_backend
+
+def set_ocr_backend(backend: OCRBackend):
+    global _ocr_backend
+    with _ocr_backend_lock:
+        if _ocr_backend is not None and _ocr_backend is not backend:
+            _ocr_backend.close()
+        _ocr_backend = backend
+
+_reported_ocr_errors: Set[str] = set()
+
+def _report_ocr_error(e: Exception):
+    """OCR 失敗時這一幀當成沒讀到字；同一種錯誤只警告一次，免得每一幀洗版"""
+    message = f"{type(e).__name__}: {e}"
+    if message not in _reported_ocr_errors:
+        _reported_ocr_errors.add(message)
+        print(f"[WARN] OCR failed ({message}); frames will be treated as unreadable.")
+
+def perform_ocr(image: np.ndarray, config: str = OCR_CONFIG) -> str:
     """執行 OCR (寬鬆模式，移除白名單以增加辨識率)"""
-    config = '--oem 3 --psm 6'
     try:
-        return pytesseract.image_to_string(image, config=config)
-    except:
+        return get_ocr_backend().recognize(image, config)
+    except Exception as e:
+        _report_ocr_error(e)
         return ""
 
-# =============================================================================
-# DISPLAY OVERLAY (畫面繪製)
-# =============================================================================
+def perform_ocr_lines(image: np.ndarray, config: str = OCR_CONFIG) -> List[OCRLine]:
+    """同 perform_ocr()，但回傳逐行文字與信心度 (多幀投票用)"""
+    try:
+        return get_ocr_backend().recognize_lines(image, config)
+    except Exception as e:
+        _report_ocr_error(e)
+        return []
 
-def draw_overlay(frame: np.ndarray, 
-                 display_info: Optional[dict], # 這是要顯示在中間的資訊
-                 inventory: InventoryManager,
-                 fps: float) -> np.ndarray:
-    
-    display = frame.copy()
-    h, w = display.shape[:2]
-    
-    # --- 1. 頂部狀態列 ---
-    cv2.rectangle(display, (0, 0), (w, 60), COLOR_BLACK, -1)
-    cv2.putText(display, f"FPS: {fps:.1f}", (10, 25), FONT, 0.6, COLOR_WHITE, 1)
+def perform_ocr_lines_batch(images: List[np.ndarray], config: str = OCR_CONFIG) -> List[List[OCRLine]]:
+    """多張影像一次辨識 (支援批次的後端一次推論完)"""
+    try:
+        return get_ocr_backend().recognize_batch(images, config)
+    except Exception as e:
+        _report_ocr_error(e)
+        return [[] for _ in images]
+
+# 看起來像 CAS 但沒通過驗證的文字 (例如 "CAS 64-l7-5")，值得用數字模式再讀一次
+_CAS_LIKE_PATTERN = re.compile(r'\d[\dOolISB]*\s*-\s*[\dOolISB]{2}\s*-\s*[\dOolISB]')
+
+def text_line_spans(ink_rows: np.ndarray, min_height: int = 3) -> List[Tuple[int, int]]:
+    """水平投影：ink_rows[y] 為該列是否有字，回傳每一行的 (y0, y1)"""
+    spans = []
+    start = None
+    for y, has_ink in enumerate(np.append(ink_rows, False)):
+        if has_ink and start is None:
+            start = y
+        elif not has_ink and start is not None:
+            if y - start >= min_height:
+                spans.append((start, y))
+            start = None
+    return spans
+
+def detect_text_regions(frame: np.ndarray,
+                        max_regions: int = ROI_MAX_REGIONS) -> List[Tuple[int, int, int, int]]:
+    """
+    用形態學梯度找出畫面中的文字行區塊，回傳 (x, y, w, h) (原始影格座標)。
+    梯度 -> Otsu 二值化 -> 水平方向閉運算把字元連成一行 -> 取輪廓外框並過濾。
+    文字行貼著標籤外框時會跟外框連成同一個輪廓：有這種填滿率低的大輪廓時，用斷開運算去掉細線再找一次；
+    相鄰幾行黏成一大塊時，依水平投影切回單行。
+    """
+    h, w = frame.shape[:2]
+    scale = min(1.0, ROI_DETECT_WIDTH / w)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    sh, sw = small.shape[:2]
     
-    # 盤點進度
-    scanned = inventory.scanned_count
-    total = inventory.total_count
-    prog_text = f"Scanned: {scanned} / {total}"
-    cv2.putText(display, prog_text, (w - 320, 35), FONT, 0.8, COLOR_CYAN, 2)
+    grad = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, bw = cv2.threshold(grad, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    connected = cv2.morphologyEx(bw, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
     
-    # --- 2. [新增] 右側歷史面板 ---
-    panel_width = 300
-    overlay = display.copy()
-    # 畫一個半透明背景
-    cv2.rectangle(overlay, (w - panel_width, 60), (w, h), COLOR_PANEL_BG, -1)
-    cv2.addWeighted(overlay, 0.8, display, 0.2, 0, display)
+    def is_line(x: int, y: int, cw: int, ch: int) -> bool:
+        # 文字行：有一定高度、比高還寬、不能佔掉大半畫面；外框、瓶身邊緣這類細長線條的填滿率很低
+        if ch < 6 or ch > sh * 0.3 or cw < ch * 1.5 or cw > sw * 0.95:
+            return False
+        return cv2.countNonZero(connected[y:y + ch, x:x + cw]) / float(cw * ch) >= 0.45
     
-    # 歷史標題
-    cv2.putText(display, "--- History (Last 8) ---", (w - panel_width + 10, 90), FONT, 0.6, COLOR_YELLOW, 1)
+    for erase_outlines in (False, True):
+        candidates = []
+        # RETR_CCOMP：標籤外框內的文字行也會是頂層輪廓 (RETR_EXTERNAL 會被外框整個包住)
+        contours, hierarchy = cv2.findContours(connected, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        outlines = 0
+        for contour, (_, _, _, parent) in zip(contours, hierarchy[0] if hierarchy is not None else []):
+            if parent != -1:
+                continue
+            x, y, cw, ch = cv2.boundingRect(contour)
+            if is_line(x, y, cw, ch):
+                candidates.append((cw * ch, x, y, cw, ch))
+            elif ch >= 12 and cw >= 12:
+                outlines += 1
+                # 太高的區塊可能是幾行黏在一起：依水平投影切開
+                block = connected[y:y + ch, x:x + cw]
+                for y0, y1 in text_line_spans(np.count_nonzero(block, axis=1) > cw * 0.2, 6):
+                    cols = np.flatnonzero(np.count_nonzero(block[y0:y1], axis=0))
+                    lx, lw = x + cols[0], cols[-1] - cols[0] + 1
+                    if is_line(lx, y + y0, lw, y1 - y0):
+                        candidates.append((lw * (y1 - y0), lx, y + y0, lw, y1 - y0))
+        if erase_outlines or not outlines:
+            break
+        # 外框線只有 1~2 px 粗，3x3 斷開運算就會消失；閉運算後的文字行夠粗，不受影響
+        connected = cv2.morphologyEx(connected, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
     
-    # 畫出最近的項目 (倒序排列，最新的在上面)
-    y_pos = 130
-    for item in reversed(inventory.scan_history):
-        # 顯示 CAS
-        cv2.putText(display, f"{item['CAS']}", (w - panel_width + 10, y_pos), FONT, 0.6, COLOR_GREEN, 2)
-        
-        # 顯示 廠牌 與 時間 (避免顯示中文 Name 以防亂碼)
-        sub_text = f"@{item['Brand']} ({item['Time']})"
-        cv2.putText(display, sub_text, (w - panel_width + 10, y_pos + 25), FONT, 0.5, COLOR_WHITE, 1)
+    candidates.sort(reverse=True)
+    regions = []
+    for _, x, y, cw, ch in candidates[:max_regions]:
+        # 換回原始座標並留一點邊界 (Tesseract 需要字旁邊有空白)
+        pad = max(2, int(ch * 0.25))
+        x0 = max(0, int((x - pad) / scale)); y0 = max(0, int((y - pad) / scale))
+        x1 = min(w, int((x + cw + pad) / scale)); y1 = min(h, int((y + ch + pad) / scale))
+        regions.append((x0, y0, x1 - x0, y1 - y0))
+    return regions
+
+def perform_ocr_regions_lines(frame: np.ndarray, max_regions: int = ROI_MAX_REGIONS) -> List[OCRLine]:
+    """只對偵測到的文字區塊 (最多 max_regions 個) 做 OCR，依區塊順序回傳各行文字與信心度"""
+    lines = []
+    preprocessor = get_preprocessor()
+    with job_stage('ocr_detect'):
+        regions = detect_text_regions(frame, max_regions)
+    if not regions:
+        # 找不到文字區塊 (標籤太斜、太糊或整塊黏在一起) -> 改讀整張畫面，不要整幀白白略過
+        return perform_ocr_full_frame_lines(frame)
+    if get_ocr_backend().batched:
+        return _perform_ocr_regions_batched(frame, regions)
+    for x, y, w, h in regions:
+        # 依區塊高度從尺度金字塔挑倍率：小字放大、大字縮小
+        with job_stage('ocr_preprocess'):
+            binary = preprocessor.run(frame[y:y + h, x:x + w], choose_scale(h), get_ocr_backend().binary_input)
+        with job_stage('ocr_tesseract'):
+            region_lines = cached_ocr_lines(binary, ROI_OCR_CONFIG)
+            # CAS 行但沒讀出有效號碼 -> 用數字/連字號白名單再讀一次
+            text = join_lines(region_lines)
+            if not extract_cas_numbers(text) and _CAS_LIKE_PATTERN.search(text):
+                region_lines = region_lines + cached_ocr_lines(binary, CAS_LINE_OCR_CONFIG)
+        lines.extend(region_lines)
+    return lines
+
+def _perform_ocr_regions_batched(frame: np.ndarray, regions: List[Tuple[int, int, int, int]]) -> List[OCRLine]:
+    """同上，但所有區塊前處理完後整批辨識 (CAS 行的白名單重讀也整批)"""
+    preprocessor = get_preprocessor()
+    binarize = get_ocr_backend().binary_input
+    with job_stage('ocr_preprocess'):
+        # 前處理緩衝區會被下一個區塊覆寫，整批送出前要各自複製
+        binaries = [preprocessor.run(frame[y:y + h, x:x + w], choose_scale(h), binarize).copy()
+                    for x, y, w, h in regions]
+    with job_stage('ocr_recognize'):
+        region_lines = cached_ocr_lines_batch(binaries, ROI_OCR_CONFIG)
+        retry = [i for i, lines in enumerate(region_lines)
+                 if not extract_cas_numbers(join_lines(lines)) and _CAS_LIKE_PATTERN.search(join_lines(lines))]
+        if retry:
+            for i, extra in zip(retry, cached_ocr_lines_batch([binaries[i] for i in retry], CAS_LINE_OCR_CONFIG)):
+                region_lines[i] = region_lines[i] + extra
+    return [line for lines in region_lines for line in lines]
+
+def perform_ocr_regions(frame: np.ndarray) -> str:
+    """只對偵測到的文字區塊做 OCR，各區塊結果以換行串接"""
+    return join_lines(perform_ocr_regions_lines(frame))
+
+def perform_ocr_full_frame_lines(frame: np.ndarray) -> List[OCRLine]:
+    """整張畫面前處理後一次 OCR"""
+    with job_stage('ocr_preprocess'):
+        binary = get_preprocessor().run(frame, FULL_FRAME_OCR_SCALE, get_ocr_backend().binary_input)
+    with job_stage('ocr_tesseract'):
+        return cached_ocr_lines(binary)
+
+def recognize_frame_lines(frame: np.ndarray, max_regions: int = ROI_MAX_REGIONS) -> List[OCRLine]:
+    """依設定選擇 ROI 模式或整張畫面 OCR (max_regions 只用於 ROI 模式)"""
+    if OCR_USE_ROI:
+        return perform_ocr_regions_lines(frame, max_regions)
+    return perform_ocr_full_frame_lines(frame)
+
+def recognize_frame(frame: np.ndarray) -> str:
+    return join_lines(recognize_frame_lines(frame))
+
+# =============================================================================
+# ADAPTIVE OCR SCHEDULER (模糊 / 靜止畫面略過)
+# =============================================================================
+
+def sharpness_score(gray: np.ndarray) -> float:
+    """Laplacian 變異數：越高越清晰"""
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+def dhash(gray: np.ndarray, width: int = 8, height: int = 8) -> int:
+    """difference hash (感知雜湊，預設 64-bit)，畫面小幅晃動時值幾乎不變"""
+    small = cv2.resize(gray, (width + 1, height), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def label_hash(gray: np.ndarray) -> int:
+    """
+    標籤區域的 256-bit 雜湊：文字區塊的聯集 (找不到時用整張畫面) 以 Otsu 二值化後取 32x8 dHash。
+    整張畫面的 8x8 dHash 幾乎只看得到背景與瓶身，同一個位置換一罐也不會變；
+    二值化後紙面上的雜訊不會翻動位元，只有文字內容與排版會。
+    """
+    regions = detect_text_regions(gray)
+    if regions:
+        x0 = min(x for x, _, _, _ in regions); y0 = min(y for _, y, _, _ in regions)
+        x1 = max(x + w for x, _, w, _ in regions); y1 = max(y + h for _, y, _, h in regions)
+        gray = gray[y0:y1, x0:x1]
+    _, bw = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    return dhash(bw, 32, 8)
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+class OCRScheduler:
+    """
+    放在 perform_ocr() 前面的便宜閘門：
+    - 清晰度不夠 (手在晃) -> 跳過
+    - 跟上一次「有掃到東西」或上一次送出的畫面一樣 -> 跳過，但每 STATIC_RETRY_FRAMES 幀仍重試一次
+      (只差一兩個字的兩張標籤雜湊可能一樣，不能永遠略過)
+    畫面是否相同以標籤區域的雜湊 (label_hash) 判斷。
+    OCR_FRAME_INTERVAL 仍是兩次 OCR 之間的最小間隔。
+    """
+
+    def __init__(self, min_interval: int = OCR_FRAME_INTERVAL,
+                 sharpness_threshold: float = SHARPNESS_THRESHOLD,
+                 change_distance: int = CHANGE_HASH_DISTANCE,
+                 retry_frames: int = STATIC_RETRY_FRAMES):
+        self.min_interval = min_interval
+        self.sharpness_threshold = sharpness_threshold
+        self.change_distance = change_distance
+        self.retry_frames = retry_frames
         
-        # 分隔線
-        cv2.line(display, (w - panel_width + 5, y_pos + 35), (w - 5, y_pos + 35), COLOR_GRAY, 1)
+        self._last_fire_frame = -min_interval
+        self._last_fire_hash: Optional[int] = None
+        self._matched_hash: Optional[int] = None
+        self._matched_frame = 0
+        self._fired_hashes: Dict[int, int] = {}  # frame_id -> hash (非同步結果回來時用)
+        self._reread_pending = False
+        self.reread = False  # 最近一次觸發是投票用的重讀：要真的再辨識一次，不能用快取的結果
         
-        y_pos += 60
-        if y_pos > h - 50: break
+        self.fired = 0
+        self.skipped_blurry = 0
+        self.skipped_static = 0
+        self.last_sharpness = 0.0
+
+    @property
+    def saved(self) -> int:
+        """相較固定每 OCR_FRAME_INTERVAL 幀辨識一次，省下的 OCR 次數"""
+        return self.skipped_blurry + self.skipped_static
+
+    def _skip(self, frame_id: int, reason: str) -> bool:
+        # 只在原本固定排程會觸發 OCR 的幀計數，才能跟舊行為直接比較
+        if frame_id % self.min_interval == 0:
+            setattr(self, reason, getattr(self, reason) + 1)
+        return False
 
-    # --- 3. [新增] 中央掃描結果 (具備視覺暫留功能) ---
-    if display_info:
-        info = display_info
+    def should_ocr(self, frame_id: int, frame: np.ndarray) -> bool:
+        if frame_id - self._last_fire_frame < self.min_interval:
+            return False
         
-        # 定義框框位置 (避開右側面板)
-        box_w_start = 50
-        box_w_end = w - panel_width - 50
-        box_h_start = h - 220
-        box_h_end = h - 50
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        scale = 320.0 / gray.shape[1]
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        
+        self.last_sharpness = sharpness_score(small)
+        if self.last_sharpness < self.sharpness_threshold:
+            return self._skip(frame_id, 'skipped_blurry')
+        
+        frame_hash = label_hash(gray)
+        if self._matched_hash is not None and \
+                frame_id - self._matched_frame < self.retry_frames and \
+                hamming_distance(frame_hash, self._matched_hash) <= self.change_distance:
+            return self._skip(frame_id, 'skipped_static')
+        if self._last_fire_hash is not None and \
+                frame_id - self._last_fire_frame < self.retry_frames and \
+                hamming_distance(frame_hash, self._last_fire_hash) <= self.change_distance:
+            return self._skip(frame_id, 'skipped_static')
+        
+        self._last_fire_frame = frame_id
+        self._last_fire_hash = frame_hash
+        self._fired_hashes[frame_id] = frame_hash
+        if len(self._fired_hashes) > 32:
+            self._fired_hashes.pop(next(iter(self._fired_hashes)))
+        self.reread, self._reread_pending = self._reread_pending, False
+        self.fired += 1
+        return True
+
+    def mark_matched(self, frame_id: int):
+        """這個影格的 OCR 結果有比對成功 -> 之後 STATIC_RETRY_FRAMES 幀內同樣的畫面就不用再辨識"""
+        frame_hash = self._fired_hashes.get(frame_id)
+        if frame_hash is not None:
+            self._matched_hash = frame_hash
+            self._matched_frame = frame_id
+
+    def mark_candidate(self, frame_id: int):
+        """讀到 CAS 但投票還沒確認 -> 同樣的畫面不必等 STATIC_RETRY_FRAMES，下一個間隔就再讀一次 (不用快取)"""
+        if self._fired_hashes.get(frame_id) == self._last_fire_hash:
+            self._last_fire_hash = None
+        self._reread_pending = True
+
+# =============================================================================
+# OCR RESULT CACHE (感知雜湊 LRU 快取)
+# =============================================================================
+
+def region_hash(binary: np.ndarray) -> int:
+    """前處理後區塊的感知雜湊：文字行用 32x8 (256-bit)，接近方形的整張畫面用 32x16"""
+    h, w = binary.shape[:2]
+    return dhash(binary, 32, 8 if w >= h * 3 else 16)
+
+class OCRCache:
+    """有容量上限 (LRU) 與存活時間 (TTL) 的 OCR 結果快取；背景執行緒共用，需上鎖"""
+
+    def __init__(self, max_size: int = OCR_CACHE_SIZE, ttl: float = OCR_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, Tuple[float, List[OCRLine]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple) -> Optional[List[OCRLine]]:
+        # 只接受雜湊完全相同：差幾個 bit 的可能就是差一位數的另一個 CAS (108-88-3 / 108-38-3)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() - entry[0] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, lines: List[OCRLine]):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), lines)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# 全域快取 (多行程模式下每個工作行程各有一份)
+OCR_CACHE = OCRCache()
+
+# 目前執行緒上的 OCR 工作：是否略過快取 (bypass)，以及命中/未命中的區塊數 (stats)
+_ocr_cache_job = threading.local()
+
+def _use_ocr_cache() -> bool:
+    return OCR_CACHE.max_size > 0 and not getattr(_ocr_cache_job, 'bypass', False)
+
+def _count_ocr_cache(hits: int, misses: int):
+    stats = getattr(_ocr_cache_job, 'stats', None)
+    if stats is not None:
+        stats['hits'] += hits
+        stats['misses'] += misses
+
+def cached_ocr_lines(binary: np.ndarray, config: str = OCR_CONFIG) -> List[OCRLine]:
+    """先查快取，沒有才呼叫 Tesseract (略過快取時仍會寫入新結果)"""
+    if OCR_CACHE.max_size <= 0:
+        _count_ocr_cache(0, 1)
+        return perform_ocr_lines(binary, config)
+    h, w = binary.shape[:2]
+    key = (config, round(w / h, 1), region_hash(binary))
+    cached = OCR_CACHE.get(key) if _use_ocr_cache() else None
+    if cached is not None:
+        _count_ocr_cache(1, 0)
+        return cached
+    _count_ocr_cache(0, 1)
+    lines = perform_ocr_lines(binary, config)
+    OCR_CACHE.put(key, lines)
+    return lines
+
+def cached_ocr_lines_batch(binaries: List[np.ndarray], config: str = OCR_CONFIG) -> List[List[OCRLine]]:
+    """批次版：先查快取，沒命中的整批交給後端"""
+    if OCR_CACHE.max_size <= 0:
+        _count_ocr_cache(0, len(binaries))
+        return perform_ocr_lines_batch(binaries, config)
+    keys = [(config, round(b.shape[1] / b.shape[0], 1), region_hash(b)) for b in binaries]
+    results = [OCR_CACHE.get(key) for key in keys] if _use_ocr_cache() else [None] * len(keys)
+    misses = [i for i, lines in enumerate(results) if lines is None]
+    _count_ocr_cache(len(keys) - len(misses), len(misses))
+    if misses:
+        for i, lines in zip(misses, perform_ocr_lines_batch([binaries[i] for i in misses], config)):
+            OCR_CACHE.put(keys[i], lines)
+            results[i] = lines
+    return results
+
+def cached_ocr(binary: np.ndarray, config: str = OCR_CONFIG) -> str:
+    return join_lines(cached_ocr_lines(binary, config))
+
+# =============================================================================
+# BARCODE FAST PATH (條碼 / QR / DataMatrix)
+# =============================================================================
+
+# GS1 應用識別碼 (AI) -> 固定長度 (None = 變動長度，以 FNC1 (\x1d) 結束)
+_GS1_AI_LENGTHS = {'00': 18, '01': 14, '02': 14, '10': None, '11': 6, '13': 6, '15': 6, '17': 6,
+                   '21': None, '240': None, '241': None, '30': None, '90': None, '91': None}
+_GS1_SYMBOLOGY_PREFIX = re.compile(r'^\][A-Za-z]\d')   # ]d2 (DataMatrix)、]C1 (GS1-128)、]Q3 (QR)
+_GS1_BRACKETED = re.compile(r'\((\d{2,4})\)([^()]*)')  # 人看得懂的 "(01)0...(10)AB12"
+_CODE_TOKEN_SPLIT = re.compile(r'[\s;,|/]+')
+# 條碼內容裡的 CAS：整串就是號碼，或前面標明 "CAS" / "CAS No." / "CAS RN"；條碼不會誤讀，只收純數字
+# (批號、日期 "LOT 2024-11-5" 這類剛好通過校驗的數字不算)
+_PAYLOAD_CAS_PATTERN = re.compile(
+    r'^\s*(\d{2,7}-\d{2}-\d)\s*$|\bCAS(?:\s*(?:No\.?|RN|#))?\s*[:=]?\s*(\d{2,7}-\d{2}-\d)(?![\w-])', re.IGNORECASE)
+
+def normalize_catalog(code: str) -> str:
+    """型錄編號只比對英數字 (大小寫、連字號、空白都不算)"""
+    return re.sub(r'[^0-9A-Z]', '', code.upper())
+
+def gtin_checksum_ok(code: str) -> bool:
+    """GTIN-8/12/13/14 (EAN/UPC) 檢查碼：由右數來奇數位 x3、偶數位 x1，總和為 10 的倍數"""
+    if len(code) not in (8, 12, 13, 14) or not code.isdigit():
+        return False
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(reversed(code)))
+    return total % 10 == 0
+
+def parse_gs1(payload: str) -> Dict[str, str]:
+    """解析 GS1 元素字串 (GS1 DataMatrix / GS1-128 / GS1 QR)，不是 GS1 格式時回傳空 dict"""
+    bracketed = _GS1_BRACKETED.findall(payload)
+    if bracketed:
+        return {ai: value.strip() for ai, value in bracketed}
+    data = _GS1_SYMBOLOGY_PREFIX.sub('', payload).lstrip('\x1d')
+    if not data.startswith('01') and not _GS1_SYMBOLOGY_PREFIX.match(payload):
+        return {}  # 只有 (01) GTIN 開頭或帶 GS1 符號識別字的才當成 GS1，避免把一般編號拆錯
+    fields: Dict[str, str] = {}
+    i = 0
+    while i < len(data):
+        if data[i] == '\x1d':  # 固定長度欄位後面也可能多放一個 FNC1
+            i += 1
+            continue
+        ai = next((a for a in (data[i:i + 2], data[i:i + 3]) if a in _GS1_AI_LENGTHS), None)
+        if ai is None:
+            break  # 不認得的 AI：後面無法確定怎麼切，保留已解析的部分
+        i += len(ai)
+        length = _GS1_AI_LENGTHS[ai]
+        if length is None:
+            end = data.find('\x1d', i)
+            end = len(data) if end < 0 else end
+            fields[ai] = data[i:end]
+            i = end + 1
+        else:
+            fields[ai] = data[i:i + length]
+            i += length
+    return fields
+
+class CatalogIndex:
+    """
+    型錄編號 (或 GTIN) -> CAS 對照表，把條碼內容轉成 CAS：
+    1. 內容本身標明 CAS (自製標籤的 QR) -> 直接用
+    2. GS1 條碼 -> 以 (240) 型錄編號、(241) 客戶料號、(01) GTIN 查表
+    3. 其他 -> 整串或拆開的片段查表；條碼比型錄編號長時 (後面接包裝規格) 以最長相符前綴查表
+    純數字的內容 (EAN/UPC/GTIN 等) 只接受完全相符，且 GTIN 要先通過檢查碼，
+    以免把不相干的商品條碼前幾碼對到較短的數字型錄編號。
+    給了 known_cas (庫存裡的 CAS) 時只回傳其中的號碼，其他的當成沒解出來 (工作端會改跑 OCR)。
+    """
+
+    def __init__(self, entries: Optional[Dict[str, str]] = None, known_cas: Optional[Set[str]] = None):
+        self._index: Dict[str, str] = {}
+        self.known_cas = known_cas
+        for catalog, cas in (entries or {}).items():
+            self.add(catalog, cas)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def add(self, catalog: str, cas: str):
+        key = normalize_catalog(catalog)
+        if key and cas:
+            self._index.setdefault(key, cas)
+
+    def load_csv(self, path: str) -> int:
+        """讀取 Catalog,CAS 兩欄的對照檔 (可有其他欄位)，回傳新增筆數"""
+        before = len(self._index)
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                row = {INVENTORY_HEADER_MAPPING.get(k.strip(), k.strip()): (v or '').strip()
+                       for k, v in row.items() if k}
+                self.add(row.get('Catalog', ''), row.get('CAS', ''))
+        return len(self._index) - before
+
+    def _lookup_key(self, key: str) -> Optional[str]:
+        cas = self._index.get(key)
+        if cas is not None or len(key) <= CATALOG_MIN_PREFIX or key.isdigit():
+            return cas
+        for end in range(len(key) - 1, CATALOG_MIN_PREFIX - 1, -1):
+            cas = self._index.get(key[:end])
+            if cas is not None:
+                return cas
+        return None
+
+    def resolve(self, payload: str) -> List[str]:
+        """條碼內容 -> CAS 清單 (解不出來時為空)"""
+        cas_numbers = [cas for match in _PAYLOAD_CAS_PATTERN.finditer(payload) for cas in match.groups() if cas]
+        if cas_numbers:
+            valid = validate_cas_batch([cas.replace('-', '') for cas in cas_numbers])
+            cas_numbers = [cas for cas, ok in zip(cas_numbers, valid) if ok and self._known(cas)]
+            if cas_numbers:
+                return list(dict.fromkeys(cas_numbers))
+        gs1 = parse_gs1(payload)
+        if gs1:
+            gtin = gs1.get('01', '')
+            if not gtin_checksum_ok(gtin):
+                gtin = ''
+            candidates = [gs1.get('240', ''), gs1.get('241', ''), gtin, gtin[1:] if gtin.startswith('0') else '']
+        else:
+            candidates = [payload] + _CODE_TOKEN_SPLIT.split(payload)
+        for candidate in candidates:
+            key = normalize_catalog(candidate)
+            cas = self._lookup_key(key) if key else None
+            if cas is not None and self._known(cas):
+                return [cas]
+        return []
+
+    def _known(self, cas: str) -> bool:
+        return self.known_cas is None or cas in self.known_cas
+
+class BarcodeDecoder:
+    """
+    條碼解碼器：OpenCV QR 偵測 / barcode 模組 (EAN/UPC 等) 一定有；
+    QR 先用快很多的 QRCodeDetectorAruco 找，找到卻解不開時才交給原本的 QRCodeDetector 再試一次。
+    有安裝 pyzbar (Code128、Code39 等一維條碼) 或 pylibdmtx (DataMatrix) 時一併使用。
+    """
+
+    def __init__(self, detect_width: int = BARCODE_DETECT_WIDTH):
+        self.detect_width = detect_width
+        self._qr = cv2.QRCodeDetector()
+        self._qr_fast = cv2.QRCodeDetectorAruco() if hasattr(cv2, 'QRCodeDetectorAruco') else None
+        self._barcode = cv2.barcode.BarcodeDetector() if hasattr(cv2, 'barcode') else None
+        try:
+            from pyzbar import pyzbar
+            self._zbar = pyzbar
+        except ImportError:
+            self._zbar = None
+        try:
+            from pylibdmtx import pylibdmtx
+            self._dmtx = pylibdmtx
+        except ImportError:
+            self._dmtx = None
+
+    @property
+    def backends(self) -> List[str]:
+        names = ['qr'] + (['barcode'] if self._barcode else [])
+        return names + (['pyzbar'] if self._zbar else []) + (['datamatrix'] if self._dmtx else [])
+
+    def decode(self, frame: np.ndarray) -> List[str]:
+        """回傳畫面中所有解得出的條碼內容 (去除重複，依找到的順序)"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        h, w = gray.shape[:2]
+        if w > self.detect_width:
+            gray = cv2.resize(gray, (self.detect_width, round(h * self.detect_width / w)),
+                              interpolation=cv2.INTER_AREA)
+        payloads: List[str] = []
+        ok, decoded = True, ('',)
+        if self._qr_fast is not None:
+            ok, decoded, *_ = self._qr_fast.detectAndDecodeMulti(gray)
+        if ok and not all(decoded):
+            ok, decoded, *_ = self._qr.detectAndDecodeMulti(gray)
+        if ok:
+            payloads.extend(decoded)
+        if self._barcode is not None:
+            ok, decoded, *_ = self._barcode.detectAndDecodeMulti(gray)
+            if ok:
+                payloads.extend(decoded)
+        if self._zbar is not None:
+            payloads.extend(code.data.decode('utf-8', 'replace') for code in self._zbar.decode(gray))
+        if self._dmtx is not None:
+            payloads.extend(code.data.decode('utf-8', 'replace') for code in
+                            self._dmtx.decode(gray, timeout=BARCODE_DATAMATRIX_TIMEOUT_MS, max_count=4))
+        return list(dict.fromkeys(p for p in payloads if p))
+
+_barcode_decoders = threading.local()
+
+def get_barcode_decoder() -> BarcodeDecoder:
+    """目前執行緒的解碼器 (OpenCV 偵測器物件不保證可跨執行緒共用)"""
+    decoder = getattr(_barcode_decoders, 'instance', None)
+    if decoder is None:
+        decoder = _barcode_decoders.instance = BarcodeDecoder()
+    return decoder
+
+# 目前盤點用的型錄對照表 (多行程模式下由 _init_ocr_worker 傳給子行程)
+_CATALOG_INDEX = CatalogIndex()
+
+def set_catalog_index(index: CatalogIndex):
+    global _CATALOG_INDEX
+    _CATALOG_INDEX = index
+
+def get_catalog_index() -> CatalogIndex:
+    return _CATALOG_INDEX
+
+def decode_codes(frame: np.ndarray) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """解碼畫面中的條碼，回傳 (條碼內容, 解出的 CAS)"""
+    payloads = get_barcode_decoder().decode(frame)
+    cas_numbers: List[str] = []
+    for payload in payloads:
+        cas_numbers.extend(_CATALOG_INDEX.resolve(payload))
+    return tuple(payloads), tuple(dict.fromkeys(cas_numbers))
+
+# =============================================================================
+# ASYNC OCR ENGINE (背景 OCR 工作池)
+# =============================================================================
+
+class OCRResult(NamedTuple):
+    frame_id: int
+    text: str
+    cas_numbers: List[str]
+    source: int = 0  # 來自哪一個鏡頭 (多鏡頭模式)
+    confidences: Tuple[float, ...] = ()  # 與 cas_numbers 對應的 OCR 信心度 (0~100)
+    timings: Optional[Dict[str, float]] = None  # 工作內各階段耗時 (秒)，由主行程寫入 METRICS
+    codes: Tuple[str, ...] = ()     # 畫面中解出的條碼內容
+    code_cas: Tuple[str, ...] = ()  # 由條碼解出、庫存裡有的 CAS (有值時這一幀沒有跑 OCR)
+    cached: bool = False            # 所有文字都來自 OCR 快取 (同一張影像的舊結果，不是獨立的一次讀取)
+
+def _init_ocr_worker(tesseract_cmd: str, catalog_index: Optional[CatalogIndex] = None):
+    """工作行程初始化 (多行程模式下子行程需要重新設定 Tesseract 路徑與型錄對照表)"""
+    set_tesseract_cmd(tesseract_cmd)
+    if catalog_index is not None:
+        set_catalog_index(catalog_index)
+
+def _ocr_job(frame_id: int, frame: np.ndarray, source: int = 0, use_cache: bool = True,
+             max_regions: int = ROI_MAX_REGIONS) -> OCRResult:
+    """
+    在背景執行的完整辨識流程：條碼 -> (解不出 CAS 時) 前處理 -> OCR -> CAS 擷取
+    use_cache=False 時不讀 OCR 快取 (投票用的重讀必須是獨立的一次辨識)；
+    max_regions 為最多辨識幾個文字區塊 (照片切塊一塊裡可能有好幾張標籤，要比單一鏡頭畫面多)。
+    """
+    start = time.perf_counter()
+    timings = _job_timings.current = {}
+    cache_stats = _ocr_cache_job.stats = {'hits': 0, 'misses': 0}
+    _ocr_cache_job.bypass = not use_cache
+    codes: Tuple[str, ...] = ()
+    try:
+        if ENABLE_BARCODE:
+            with job_stage('barcode'):
+                codes, code_cas = decode_codes(frame)
+            if code_cas:
+                timings['ocr_total'] = time.perf_counter() - start
+                return OCRResult(frame_id, '', [], source, (), timings, codes, code_cas)
+        lines = recognize_frame_lines(frame, max_regions)
+        # 逐行擷取，每個 CAS 取讀到它的那一行的信心度 (同一號碼出現多次取最高)
+        with job_stage('ocr_extract'):
+            confidence: Dict[str, float] = {}
+            for line, numbers in zip(lines, extract_cas_numbers_batch([line.text for line in lines])):
+                for cas in numbers:
+                    confidence[cas] = max(confidence.get(cas, 0.0), line.confidence)
+    finally:
+        _job_timings.current = None
+        _ocr_cache_job.stats = None
+        _ocr_cache_job.bypass = False
+    timings['ocr_total'] = time.perf_counter() - start
+    cached = cache_stats['hits'] > 0 and cache_stats['misses'] == 0
+    return OCRResult(frame_id, join_lines(lines), list(confidence), source, tuple(confidence.values()),
+                     timings, codes, cached=cached)
+
+class AsyncOCREngine:
+    """
+    把 OCR 從擷取/繪製迴圈移到背景工作池。
+    - submit(): 交出影格，不會阻塞；工作都在忙時放進有上限的等待佇列，滿了丟最舊的
+    - poll(): 取回已完成的結果 (非阻塞)，由主迴圈在每一幀呼叫
+    多個鏡頭共用同一個工作池時，每個來源有自己的等待佇列與結果佇列，
+    空出的工作輪流分給各來源，不會讓某一台鏡頭擠掉其他鏡頭的影格。
+    """
+
+    def __init__(self, mode: str = 'thread', workers: Optional[int] = None,
+                 queue_size: int = 2):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"Unknown OCR engine mode: {mode}")
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        if mode == 'process':
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_ocr_worker,
+                initargs=(get_tesseract_cmd(), get_catalog_index()))
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='ocr')
+
+        # RLock: 若工作瞬間完成，done callback 會在 submit 的同一執行緒內被呼叫
+        self._lock = threading.RLock()
+        self._queue_size = queue_size
+        self._pending: "OrderedDict[int, deque]" = OrderedDict()  # 來源 -> 等待中的影格
+        self._in_flight = 0
+        self._results: Dict[int, "queue.SimpleQueue[OCRResult]"] = {}
+        self._closed = False
+
+        self.submitted = 0
+        self.dropped = 0
+        self.dropped_by_source: Counter = Counter()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self._pending.values())
+
+    def source_queue_depth(self, source: int) -> int:
+        pending = self._pending.get(source)
+        return len(pending) if pending else 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _result_queue(self, source: int) -> "queue.SimpleQueue[OCRResult]":
+        with self._lock:
+            results = self._results.get(source)
+            if results is None:
+                results = self._results[source] = queue.SimpleQueue()
+            return results
+
+    def submit(self, frame_id: int, frame: np.ndarray, source: int = 0, use_cache: bool = True):
+        with self._lock:
+            if self._closed:
+                return
+            self.submitted += 1
+            self._result_queue(source)
+            if self._in_flight < self.workers:
+                self._dispatch(frame_id, frame, source, use_cache)
+            else:
+                pending = self._pending.get(source)
+                if pending is None:
+                    pending = self._pending[source] = deque(maxlen=self._queue_size)
+                if len(pending) == pending.maxlen:
+                    self.dropped += 1
+                    self.dropped_by_source[source] += 1
+                pending.append((frame_id, frame, source, use_cache))
+
+    def _dispatch(self, frame_id: int, frame: np.ndarray, source: int, use_cache: bool = True):
+        # 呼叫端必須持有 self._lock
+        self._in_flight += 1
+        future = self._executor.submit(_ocr_job, frame_id, frame, source, use_cache)
+        future.add_done_callback(self._on_done)
+
+    def _dispatch_next(self):
+        # 輪流服務各來源：取出第一個有影格的來源後把它移到最後
+        for source, pending in self._pending.items():
+            if pending:
+                self._pending.move_to_end(source)
+                self._dispatch(*pending.popleft())
+                return
+
+    def _on_done(self, future):
+        if not future.cancelled():
+            try:
+                result = future.result()
+                self._result_queue(result.source).put(result)
+            except Exception as e:
+                print(f"[WARN] OCR worker failed: {e}")
+        with self._lock:
+            self._in_flight -= 1
+            if not self._closed:
+                self._dispatch_next()
+
+    def poll(self, source: int = 0) -> List[OCRResult]:
+        results = []
+        done = self._result_queue(source)
+        while True:
+            try:
+                results.append(done.get_nowait())
+            except queue.Empty:
+                return results
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._pending.clear()
+        # 等正在執行的工作結束，之後才能安全關閉 OCR 後端
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+# =============================================================================
+# DISPLAY OVERLAY (畫面繪製)
+# =============================================================================
+
+class _Sprite(NamedTuple):
+    key: tuple
+    x: int
+    y: int
+    bgr: np.ndarray
+    mask: Optional[np.ndarray]  # 不透明像素 (文字、框線)；None = 整塊不透明
+    bg_alpha: float             # 其餘像素以此比例與畫面混合 (0 = 完全透明)
+
+class OverlayRenderer:
+    """
+    分層 HUD 繪製：狀態列、歷史面板、結果框各自預先畫成 sprite (BGR + 遮罩)，
+    只有內容改變時才重畫；每一幀只把 sprite 混合到對應的 ROI，不複製整張畫面。
+    """
+    PANEL_WIDTH = 300
+    STATUS_HEIGHT = 60
+
+    def __init__(self):
+        self._sprites: Dict[str, _Sprite] = {}
+        self.rebuilds: Counter = Counter()  # 每個圖層重畫的次數 (除錯用)
+
+    def _get(self, name: str, key: tuple, build) -> _Sprite:
+        sprite = self._sprites.get(name)
+        if sprite is None or sprite.key != key:
+            sprite = self._sprites[name] = build(key)
+            self.rebuilds[name] += 1
+        return sprite
+
+    @staticmethod
+    def _blit(frame: np.ndarray, sprite: _Sprite):
+        """只在 sprite 的 ROI 內原地混合 (uint8 的 addWeighted + 遮罩複製，比逐像素 alpha 快)"""
+        h, w = sprite.bgr.shape[:2]
+        roi = frame[sprite.y:sprite.y + h, sprite.x:sprite.x + w]
+        if sprite.mask is None:
+            roi[:] = sprite.bgr
+            return
+        if sprite.bg_alpha > 0:
+            cv2.addWeighted(roi, 1.0 - sprite.bg_alpha, sprite.bgr, sprite.bg_alpha, 0, dst=roi)
+        cv2.copyTo(sprite.bgr, sprite.mask, roi)
+
+    # --- 1. 頂部狀態列 (不透明) ---
+    def _build_status(self, key: tuple) -> _Sprite:
+        w, fps_text, scanned, total, brand_text, station_text = key
+        # cv2.rectangle 的終點也會被填滿，原本的狀態列實際高 61 px
+        bar = np.zeros((self.STATUS_HEIGHT + 1, w, 3), np.uint8)
+        bar[:] = COLOR_BLACK
+        cv2.putText(bar, f"FPS: {fps_text}", (10, 25), FONT, 0.6, COLOR_WHITE, 1)
+        # 多鏡頭模式：鏡頭名稱與 OCR 等待佇列深度
+        if station_text:
+            cv2.putText(bar, station_text, (130, 25), FONT, 0.6, COLOR_CYAN, 1)
+        # 盤點進度
+        cv2.putText(bar, f"Scanned: {scanned} / {total}", (w - 320, 35), FONT, 0.8, COLOR_CYAN, 2)
+        if brand_text:
+            cv2.putText(bar, brand_text, (10, 50), FONT, 0.5, COLOR_YELLOW, 1)
+        return _Sprite(key, 0, 0, bar, None, 1.0)
+
+    # --- 2. 右側歷史面板 (半透明背景 + 不透明文字) ---
+    def _build_history(self, key: tuple, history: List[Dict]) -> _Sprite:
+        w, h, _ = key
+        pw, ph = self.PANEL_WIDTH, h - self.STATUS_HEIGHT
+        panel = np.zeros((ph, pw, 3), np.uint8)
+        panel[:] = COLOR_PANEL_BG
+        mask = np.zeros((ph, pw), np.uint8)
+        oy = self.STATUS_HEIGHT  # 面板座標 = 畫面座標往上移 oy
+
+        def text(t, pos, scale, color, thickness):
+            cv2.putText(panel, t, pos, FONT, scale, color, thickness)
+            cv2.putText(mask, t, pos, FONT, scale, 255, thickness)
+
+        # 歷史標題
+        text("--- History (Last 8) ---", (10, 90 - oy), 0.6, COLOR_YELLOW, 1)
+        # 畫出最近的項目 (倒序排列，最新的在上面)
+        y_pos = 130
+        for item in reversed(history):
+            text(f"{item['CAS']}", (10, y_pos - oy), 0.6, COLOR_GREEN, 2)
+            # 顯示 廠牌 與 時間 (避免顯示中文 Name 以防亂碼)
+            text(f"@{item['Brand']} ({item['Time']})", (10, y_pos + 25 - oy), 0.5, COLOR_WHITE, 1)
+            # 分隔線
+            cv2.line(panel, (5, y_pos + 35 - oy), (pw - 5, y_pos + 35 - oy), COLOR_GRAY, 1)
+            cv2.line(mask, (5, y_pos + 35 - oy), (pw - 5, y_pos + 35 - oy), 255, 1)
+            y_pos += 60
+            if y_pos > h - 50: break
+        # 背景 80% 不透明 (與原本 addWeighted(0.8, 0.2) 相同)
+        return _Sprite(key, w - pw, oy, panel, mask, 0.8)
+
+    # --- 3. 中央掃描結果框 ---
+    def _build_result(self, key: tuple) -> _Sprite:
+        w, h, cas, location, stock = key
+        margin = 2  # 邊框線寬 3，會超出矩形 1~2 px
+        x0, y0 = 50, h - 220
+        x1, y1 = w - self.PANEL_WIDTH - 50, h - 50
+        bw, bh = x1 - x0 + 2 * margin + 1, y1 - y0 + 2 * margin + 1
+        box = np.zeros((bh, bw, 3), np.uint8)
+        mask = np.zeros((bh, bw), np.uint8)
+        r0, r1 = (margin, margin), (bw - margin - 1, bh - margin - 1)
         
         # 綠色背景框
-        cv2.rectangle(display, (box_w_start, box_h_start), (box_w_end, box_h_end), (0, 100, 0), -1)
-        cv2.rectangle(display, (box_w_start, box_h_start), (box_w_end, box_h_end), COLOR_GREEN, 3)
+        cv2.rectangle(box, r0, r1, (0, 100, 0), -1)
+        cv2.rectangle(box, r0, r1, COLOR_GREEN, 3)
+        cv2.rectangle(mask, r0, r1, 255, -1)
+        cv2.rectangle(mask, r0, r1, 255, 3)
         
         # 顯示文字
-        cv2.putText(display, "MATCH FOUND!", (box_w_start + 20, box_h_start + 40), FONT, 1.0, COLOR_WHITE, 3)
+        tx, ty = margin + 20, margin
+        cv2.putText(box, "MATCH FOUND!", (tx, ty + 40), FONT, 1.0, COLOR_WHITE, 3)
+        cv2.putText(box, f"CAS: {cas}", (tx, ty + 90), FONT, 0.9, COLOR_YELLOW, 2)
+        cv2.putText(box, f"Brand: {location}", (tx, ty + 130), FONT, 0.7, COLOR_WHITE, 2)
+        cv2.putText(box, f"Stock: {stock}", (tx + 280, ty + 130), FONT, 0.7, COLOR_WHITE, 1)
+        return _Sprite(key, x0 - margin, y0 - margin, box, mask, 0.0)
+
+    # --- 4. 除錯頁面 (各階段耗時表格，半透明背景) ---
+    def _build_debug(self, key: tuple) -> _Sprite:
+        w, h, lines = key
+        line_height = 20
+        lines = lines[:max(1, (h - self.STATUS_HEIGHT - 40) // line_height)]  # 畫面太小就截斷
+        pw, ph = min(360, w - 20), 20 + line_height * len(lines)
+        page = np.zeros((ph, pw, 3), np.uint8)
+        mask = np.zeros((ph, pw), np.uint8)
+        for i, line in enumerate(lines):
+            color = COLOR_YELLOW if i == 0 else COLOR_WHITE
+            cv2.putText(page, line, (10, 22 + i * line_height), FONT, 0.45, color, 1)
+            cv2.putText(mask, line, (10, 22 + i * line_height), FONT, 0.45, 255, 1)
+        return _Sprite(key, 10, self.STATUS_HEIGHT + 10, page, mask, 0.7)
+
+    def render(self, frame: np.ndarray, display_info: Optional[dict],
+               inventory: InventoryManager, fps: float, station_text: str = "",
+               debug_lines: Optional[List[str]] = None) -> np.ndarray:
+        """直接畫在 frame 上 (會修改傳入的影格) 並回傳同一個陣列"""
+        h, w = frame.shape[:2]
+        
+        # 目前顯示藥品所屬廠牌的盤點進度 (計數器在掃描時已更新，這裡只讀取)
+        brand_text = ""
+        if display_info and display_info.get('records'):
+            brands = {b for r in display_info['records'] for b in r.brands}
+            brand_text = "  ".join(
+                "{} {}/{}".format(b, *inventory.brand_progress(b)) for b in sorted(brands))
+        
+        status_key = (w, f"{fps:.1f}", inventory.scanned_count, inventory.total_count, brand_text, station_text)
+        self._blit(frame, self._get('status', status_key, self._build_status))
+        
+        # 歷史清單由所有鏡頭共用，取一份一致的複本
+        history_version, history = inventory.history_snapshot()
+        history_key = (w, h, history_version)
+        self._blit(frame, self._get('history', history_key,
+                                    lambda key: self._build_history(key, history)))
         
-        text_cas = f"CAS: {info['CAS']}"
-        text_brand = f"Brand: {info['Location']}"
-        text_stock = f"Stock: {info['Stock']}"
+        if display_info:
+            result_key = (w, h, display_info['CAS'], display_info['Location'], display_info['Stock'])
+            self._blit(frame, self._get('result', result_key, self._build_result))
+        else:
+            # 掃描中提示
+            cv2.putText(frame, "Scanning...", (50, h - 50), FONT, 0.8, (200, 200, 200), 1)
         
-        cv2.putText(display, text_cas, (box_w_start + 20, box_h_start + 90), FONT, 0.9, COLOR_YELLOW, 2)
-        cv2.putText(display, text_brand, (box_w_start + 20, box_h_start + 130), FONT, 0.7, COLOR_WHITE, 2)
-        cv2.putText(display, text_stock, (box_w_start + 300, box_h_start + 130), FONT, 0.7, COLOR_WHITE, 1)
+        if debug_lines:
+            self._blit(frame, self._get('debug', (w, h, tuple(debug_lines)), self._build_debug))
+        return frame
 
+_default_renderer = OverlayRenderer()
+
+def draw_overlay(frame: np.ndarray, 
+                 display_info: Optional[dict], # 這是要顯示在中間的資訊
+                 inventory: InventoryManager,
+                 fps: float) -> np.ndarray:
+    """回傳畫好 HUD 的新影像 (不修改原影格)；主迴圈直接用 OverlayRenderer.render() 以省下複製"""
+    return _default_renderer.render(frame.copy(), display_info, inventory, fps)
+
+# =============================================================================
+# TEMPORAL CAS VOTING (多幀投票確認)
+# =============================================================================
+
+class CASVoter:
+    """
+    把連續幾次 OCR 讀到的 CAS 累積起來再判定：每次讀取依信心度投 0~1 票，
+    只計算最近 window 秒內的票，總票數到達 threshold 才確認。
+    已確認的 CAS 在窗口內再被讀到時直接回傳 (讓畫面維持顯示)，不必重新投票。
+    """
+
+    def __init__(self, threshold: float = CAS_VOTE_THRESHOLD,
+                 window: float = CAS_VOTE_WINDOW_SECONDS,
+                 min_confidence: float = CAS_MIN_CONFIDENCE):
+        self.threshold = threshold
+        self.window = window
+        self.min_confidence = min_confidence
+        self._votes: Dict[str, deque] = {}      # CAS -> deque[(時間, 票數)]
+        self._confirmed: Dict[str, float] = {}  # CAS -> 最後一次讀到的時間
+        
+        self.reads = 0
+        self.confirmed = 0
+        self.rejected = 0  # 信心度太低而不計票的讀取
+
+    def _prune(self, now: float):
+        for cas in [c for c, t in self._confirmed.items() if now - t > self.window]:
+            del self._confirmed[cas]
+        for cas in list(self._votes):
+            votes = self._votes[cas]
+            while votes and now - votes[0][0] > self.window:
+                votes.popleft()
+            if not votes:
+                del self._votes[cas]
+
+    def score(self, cas_number: str) -> float:
+        return sum(weight for _, weight in self._votes.get(cas_number, ()))
+
+    def add(self, cas_numbers: List[str], confidences: Tuple[float, ...] = (),
+            now: Optional[float] = None) -> List[str]:
+        """加入一次 OCR 結果，回傳確認 (或已確認) 的 CAS；沒有信心度時每次讀取算 1 票"""
+        now = time.monotonic() if now is None else now
+        self._prune(now)
+        accepted = []
+        for i, cas in enumerate(cas_numbers):
+            self.reads += 1
+            if cas in self._confirmed:
+                self._confirmed[cas] = now
+                accepted.append(cas)
+                continue
+            confidence = confidences[i] if i < len(confidences) else 100.0
+            if confidence < self.min_confidence:
+                self.rejected += 1
+                continue
+            self._votes.setdefault(cas, deque()).append((now, confidence / 100.0))
+            if self.score(cas) >= self.threshold:
+                del self._votes[cas]
+                self._confirmed[cas] = now
+                self.confirmed += 1
+                accepted.append(cas)
+        return accepted
+
+    def refresh(self, cas_numbers: List[str], now: Optional[float] = None) -> List[str]:
+        """
+        快取命中的結果 (同一張影像的舊辨識結果) 不是獨立的讀取：不投票，
+        只讓窗口內已確認的 CAS 維持顯示，回傳其中已確認的號碼。
+        """
+        now = time.monotonic() if now is None else now
+        self._prune(now)
+        accepted = [cas for cas in cas_numbers if cas in self._confirmed]
+        for cas in accepted:
+            self._confirmed[cas] = now
+        return accepted
+
+    @property
+    def pending(self) -> Dict[str, float]:
+        """還在累積票數的候選 -> 目前票數"""
+        return {cas: self.score(cas) for cas in self._votes}
+
+# =============================================================================
+# SCAN STATIONS (多鏡頭：每個鏡頭一條擷取執行緒)
+# =============================================================================
+
+def parse_camera_source(source):
+    """'1' -> 1 (攝影機索引)；其他字串 (例如 DroidCam / IP 攝影機網址) 原樣保留"""
+    if isinstance(source, str) and source.strip().isdigit():
+        return int(source)
+    return source
+
+def open_camera(source) -> cv2.VideoCapture:
+    if isinstance(source, int):
+        cap = cv2.VideoCapture(source, cv2.CAP_DSHOW)
     else:
-        # 掃描中提示
-        cv2.putText(display, "Scanning...", (50, h - 50), FONT, 0.8, (200, 200, 200), 1)
+        cap = cv2.VideoCapture(source)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+    return cap
+
+# 除錯 HUD 頁面上的階段順序 (依資料流)
+STAGE_ORDER = ['capture', 'schedule', 'ocr_submit', 'ocr_latency', 'ocr_total', 'barcode', 'ocr_detect',
+               'ocr_preprocess', 'ocr_tesseract', 'ocr_recognize', 'ocr_extract', 'match', 'render', 'display']
+
+class ScanStation(threading.Thread):
+    """
+    一個鏡頭 = 一條執行緒：讀取影格 -> 排程 -> 交給共用的 OCR 工作池 -> 比對共用的庫存 -> 畫 HUD。
+    畫好的影格放在 latest_frame，由主執行緒 imshow (OpenCV 視窗只能在主執行緒操作)。
+    """
 
-    return display
+    def __init__(self, source_id: int, label: str, cap: cv2.VideoCapture,
+                 inventory: InventoryManager, ocr_engine: Optional[AsyncOCREngine],
+                 stop_event: threading.Event, show_label: bool = False):
+        super().__init__(name=f"station-{source_id}", daemon=True)
+        self.source_id = source_id
+        self.label = label
+        self.cap = cap
+        self.inventory = inventory
+        self.ocr_engine = ocr_engine
+        self.stop_event = stop_event
+        self.tag = f"[{label}] " if show_label else ""
+        self.scheduler = OCRScheduler() if OCR_ADAPTIVE_SCHEDULER else None
+        self.voter = CASVoter() if ENABLE_CAS_VOTING else None
+        self.renderer = OverlayRenderer()
+
+        self.fps = 0.0
+        self.frame_count = 0
+        self.found = 0
+        self.latest_frame: Optional[np.ndarray] = None  # 最新一張畫好 HUD 的影格
+        
+        # 除錯 HUD 頁面 (主執行緒按 D 切換)；表格每 0.5 秒更新一次
+        self.show_metrics = False
+        self._metrics_lines: List[str] = []
+        self._metrics_updated = 0.0
+        self._submit_times: Dict[int, float] = {}  # frame_id -> 送出 OCR 的時間 (算排隊 + 辨識延遲)
+
+    @property
+    def queue_depth(self) -> int:
+        if self.ocr_engine is None: return 0
+        return self.ocr_engine.source_queue_depth(self.source_id)
+
+    def _ocr(self, frame: np.ndarray) -> List[OCRResult]:
+        # --- OCR 辨識 (由排程器決定這一幀值不值得辨識) ---
+        with METRICS.timer('schedule'):
+            if self.scheduler is not None:
+                ocr_due = self.scheduler.should_ocr(self.frame_count, frame)
+            else:
+                ocr_due = self.frame_count % OCR_FRAME_INTERVAL == 0
+        use_cache = not (ocr_due and self.scheduler is not None and self.scheduler.reread)
+        
+        if self.ocr_engine is None:
+            results = [_ocr_job(self.frame_count, frame, self.source_id, use_cache)] if ocr_due else []
+        else:
+            # 背景模式：只交出影格，結果在之後的幀非同步取回
+            if ocr_due:
+                with METRICS.timer('ocr_submit'):
+                    # HUD 會直接畫在 frame 上，交給背景工作前先複製一份
+                    self._submit_times[self.frame_count] = time.perf_counter()
+                    self.ocr_engine.submit(self.frame_count, frame.copy(), self.source_id, use_cache)
+                if len(self._submit_times) > 64:  # 被丟棄的舊影格不會有結果
+                    self._submit_times.pop(next(iter(self._submit_times)))
+            results = self.ocr_engine.poll(self.source_id)
+        
+        for result in results:
+            for stage, seconds in (result.timings or {}).items():
+                METRICS.record(stage, seconds)
+            submitted = self._submit_times.pop(result.frame_id, None)
+            if submitted is not None:
+                METRICS.record('ocr_latency', time.perf_counter() - submitted)
+        return results
+
+    def _match(self, results: List[OCRResult]) -> Optional[dict]:
+        """比對庫存 (庫存由所有鏡頭共用，InventoryManager 內部會上鎖)"""
+        current_frame_info = None
+        for result in results:
+            # 條碼解出的 CAS 不會誤讀，不必投票 (CatalogIndex 只回傳庫存裡的號碼)；沒對到時照常處理這一幀的 OCR 結果
+            barcode_info = None
+            for cas in result.code_cas:
+                barcode_info = self.inventory.lookup(cas, self.label, 100.0, match_type='barcode')
+                if barcode_info:
+                    print(f"[FOUND] {self.tag}{barcode_info['CAS']} @ {barcode_info['Location']} (barcode)")
+                    break
+            if barcode_info:
+                current_frame_info = barcode_info
+                if self.scheduler is not None:
+                    self.scheduler.mark_matched(result.frame_id)
+                continue
+            
+            cas_numbers = result.cas_numbers
+            awaiting_votes = False
+            if self.voter is not None and cas_numbers:
+                # 只投給庫存裡有的號碼，其餘 (別的標示、誤讀成不存在的號碼) 不必累積
+                known = [(cas, conf) for cas, conf in
+                         zip(cas_numbers, result.confidences or (100.0,) * len(cas_numbers))
+                         if self.inventory.lookup_all(cas)]
+                if result.cached:
+                    cas_numbers = self.voter.refresh([cas for cas, _ in known])
+                else:
+                    cas_numbers = self.voter.add([cas for cas, _ in known], tuple(conf for _, conf in known))
+                awaiting_votes = bool(known) and not cas_numbers
+                if awaiting_votes and self.scheduler is not None:
+                    self.scheduler.mark_candidate(result.frame_id)
+            confidence = dict(zip(result.cas_numbers, result.confidences))
+            for cas in cas_numbers:
+                info = self.inventory.lookup(cas, self.label, confidence.get(cas))
+                if info:
+                    current_frame_info = info
+                    if self.scheduler is not None:
+                        self.scheduler.mark_matched(result.frame_id)
+                    print(f"[FOUND] {self.tag}{info['CAS']} @ {info['Location']}")
+                    break # 一次鎖定一個
+            
+            # CAS 讀不到 -> 改用藥品名稱比對
+            # (已讀到庫存中的 CAS、只是票數還不夠時不改用名稱，免得繞過投票)
+            if current_frame_info is None and not awaiting_votes and ENABLE_NAME_MATCH and result.text:
+                info = self.inventory.fuzzy_match_name(result.text, source=self.label)
+                if info:
+                    current_frame_info = info
+                    if self.scheduler is not None:
+                        self.scheduler.mark_matched(result.frame_id)
+                    print(f"[FOUND] {self.tag}{info['Name']} (name {info['score']}) -> {info['CAS']} @ {info['Location']}")
+        return current_frame_info
+
+    def _debug_lines(self) -> Optional[List[str]]:
+        if not self.show_metrics:
+            return None
+        now = time.perf_counter()
+        if now - self._metrics_updated > 0.5:
+            self._metrics_updated = now
+            self._metrics_lines = METRICS.summary_lines(STAGE_ORDER) + [
+                f"OCR queue {self.queue_depth}  in flight {self.ocr_engine.in_flight if self.ocr_engine else 0}",
+                f"OCR cache hit {OCR_CACHE.hit_rate:.0%}"]
+        return self._metrics_lines
+
+    def run(self):
+        fps_timer = cv2.getTickCount()
+        fps_counter = 0
+        
+        # [新增] 視覺暫留控制變數
+        last_valid_info = None  # 儲存上一次找到的藥品資訊
+        last_valid_time = 0     # 儲存找到的時間點
+        
+        try:
+            while not self.stop_event.is_set():
+                with METRICS.timer('capture'):
+                    ret, frame = self.cap.read()
+                if not ret:
+                    print(f"[WARN] {self.tag}Camera stream ended.")
+                    break
+                
+                # FPS 計算
+                fps_counter += 1
+                if fps_counter >= 30:
+                    current_time = cv2.getTickCount()
+                    self.fps = fps_counter / ((current_time - fps_timer) / cv2.getTickFrequency())
+                    fps_timer = current_time
+                    fps_counter = 0
+                
+                results = self._ocr(frame)
+                with METRICS.timer('match'):
+                    current_frame_info = self._match(results)
+                if current_frame_info:
+                    self.found += 1
+                    # [更新] 只要找到，就更新「最後有效資訊」與「時間」
+                    last_valid_info = current_frame_info
+                    last_valid_time = time.time()
+                
+                # --- [新增] 決定顯示內容 (核心邏輯) ---
+                display_info = None
+                
+                # 情況 1: 這一幀剛好掃到 -> 直接顯示
+                if current_frame_info:
+                    display_info = current_frame_info
+                    
+                # 情況 2: 這一幀沒掃到，但距離上次掃到還在 3 秒內 -> 繼續顯示舊的 (視覺暫留)
+                elif last_valid_info and (time.time() - last_valid_time < RESULT_PERSISTENCE_SECONDS):
+                    display_info = last_valid_info
+                
+                # 繪製畫面 (每個鏡頭顯示自己的 FPS 與 OCR 等待佇列)
+                station_text = f"{self.label}  OCR queue: {self.queue_depth}"
+                with METRICS.timer('render'):
+                    self.renderer.render(frame, display_info, self.inventory, self.fps, station_text,
+                                         self._debug_lines())
+                self.latest_frame = frame
+                self.frame_count += 1
+        finally:
+            self.cap.release()
 
 # =============================================================================
 # MAIN
 # =============================================================================
 
-def main():
+def main(sources: Optional[list] = None, cabinets: Optional[List[str]] = None):
+    """
+    sources: 攝影機索引或串流網址的清單 (預設 CAMERA_SOURCES，再預設 CAMERA_INDEX)
+    cabinets: 選 .db 時要盤點的櫃名 (預設 STORE_CABINETS，再預設啟動時詢問)
+    """
     print("=" * 60)
     print("      Chemical Bottle Scanner - UX Enhanced")
     print("=" * 60)
@@ -342,95 +2757,181 @@ def main():
     print(f"[OK] Selected: {inventory_path}")
     
     # 2. 設定 Tesseract
-    pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
+    set_tesseract_cmd(TESSERACT_PATH)
     
-    # 3. 載入庫存
-    inventory = InventoryManager(inventory_path)
+    try:
+        print(f"[INFO] OCR backend: {get_ocr_backend().name}")
+    except (ImportError, OSError) as e:
+        print(f"[ERROR] OCR backend '{OCR_BACKEND}' unavailable: {e}")
+        return
+    
+    # 選了 .db 就開啟 SQLite 資料庫；不論盤點怎麼結束 (含中途放棄) 都要關閉
+    store = None
+    if inventory_path.lower().endswith(('.db', '.sqlite')):
+        from inventory_store import InventoryStore
+        store = InventoryStore(inventory_path)
+    try:
+        _run_scanner(inventory_path, sources, cabinets, store)
+    finally:
+        if store is not None:
+            store.close()
+
+def _run_scanner(inventory_path: str, sources: Optional[list], cabinets: Optional[List[str]],
+                 store: Optional["InventoryStore"]):
+    """main() 選好檔案之後的盤點流程 (store 由 main() 負責關閉)"""
+    # 3. 載入庫存 (選了 .db 就從 SQLite 資料庫載入這次要盤點的櫃子)
+    store_session = None
+    if store is not None:
+        cabinets = cabinets or STORE_CABINETS or select_cabinets(store)
+        if not cabinets:
+            return
+        print(f"[INFO] Cabinets: {', '.join(cabinets)}")
+        inventory = InventoryManager(inventory_path, store=store, cabinets=cabinets)
+    else:
+        inventory = InventoryManager(inventory_path)
     if inventory.total_count == 0:
         print("[ERROR] Inventory empty or load failed.")
         return
     
-    # 4. 初始化鏡頭
-    cap = cv2.VideoCapture(CAMERA_INDEX, cv2.CAP_DSHOW)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+    # 資料庫本身就是持久化的盤點紀錄 (沒結束的工作階段會接續)，不需要另外的日誌
+    journal = None
+    if store is not None:
+        store_session = store.start_session(cabinets)
+        resumed = inventory.attach_store_session(store_session)
+        print(f"[INFO] Inventory session #{store_session.id}" +
+              (f" (resumed: {inventory.scanned_count} / {inventory.total_count} found)" if resumed else ""))
+    # 掃描日誌：上次盤點沒正常結束 (當機、斷電) 就從日誌接續
+    elif ENABLE_SCAN_JOURNAL:
+        journal = ScanJournal(journal_path_for(inventory_path))
+        resumed = inventory.attach_journal(journal)
+        if resumed:
+            print(f"[INFO] Resumed unfinished session from journal: {resumed} scans, "
+                  f"{inventory.scanned_count} / {inventory.total_count} found")
+        print(f"[INFO] Scan journal: {journal.path}")
+    
+    # 4. 初始化鏡頭 (打不開的鏡頭略過，其餘照常掃描)
+    camera_start = time.perf_counter()
+    sources = [parse_camera_source(s) for s in (sources or CAMERA_SOURCES or [CAMERA_INDEX])]
+    cameras = []
+    for i, source in enumerate(sources):
+        cap = open_camera(source)
+        if not cap.isOpened():
+            print(f"[ERROR] Could not open camera: {source}")
+            continue
+        cameras.append((i, f"CAM {i + 1}", source, cap))
     
-    if not cap.isOpened():
+    if not cameras:
         print("[ERROR] Could not open webcam.")
+        if journal is not None:
+            journal.close(ended=False)  # 還沒開始盤點，下次啟動繼續使用同一份日誌
         return
-        
-    print("[INFO] Scanner started. Press 'Q' to quit.")
-    cv2.namedWindow(MAIN_WINDOW_NAME, cv2.WINDOW_NORMAL)
     
-    # 變數初始化
-    frame_count = 0
-    fps_timer = cv2.getTickCount()
-    fps_counter = 0
-    fps = 0
-    
-    # [新增] 視覺暫留控制變數
-    last_valid_info = None  # 儲存上一次找到的藥品資訊
-    last_valid_time = 0     # 儲存找到的時間點
-    
-    while True:
-        ret, frame = cap.read()
-        if not ret: break
-        
-        # FPS 計算
-        fps_counter += 1
-        if fps_counter >= 30:
-            current_time = cv2.getTickCount()
-            fps = fps_counter / ((current_time - fps_timer) / cv2.getTickFrequency())
-            fps_timer = current_time
-            fps_counter = 0
-        
-        preprocessed = preprocess_frame(frame)
-        current_frame_info = None # 這一幀是否有找到東西
-        
-        # --- OCR 辨識 ---
-        if frame_count % OCR_FRAME_INTERVAL == 0:
-            ocr_text = perform_ocr(preprocessed)
-            valid_cas_numbers = extract_cas_numbers(ocr_text)
-            
-            # 比對庫存
-            for cas in valid_cas_numbers:
-                info = inventory.lookup(cas)
-                if info:
-                    current_frame_info = info
-                    # [更新] 只要找到，就更新「最後有效資訊」與「時間」
-                    last_valid_info = info
-                    last_valid_time = time.time()
-                    print(f"[FOUND] {info['CAS']} @ {info['Location']}")
-                    break # 一次鎖定一個
+    # 啟動時間 (不含使用者選檔案的時間)
+    source = "snapshot" if inventory.loaded_from_snapshot else "CSV"
+    print(f"[INFO] Startup: imports {_IMPORT_SECONDS * 1000:.0f} ms, "
+          f"inventory {inventory.load_seconds * 1000:.0f} ms ({source}), "
+          f"camera {(time.perf_counter() - camera_start) * 1000:.0f} ms")
         
-        # --- [新增] 決定顯示內容 (核心邏輯) ---
-        display_info = None
+    # 5. 啟動 OCR 引擎 (所有鏡頭共用一個工作池)；條碼的型錄對照表要在建立工作池前設定好
+    if ENABLE_BARCODE:
+        set_catalog_index(inventory.catalog)
+        print(f"[INFO] Barcode decoders: {', '.join(get_barcode_decoder().backends)} "
+              f"({len(inventory.catalog)} catalog codes)")
+    ocr_engine = None
+    if OCR_ENGINE_MODE != 'sync':
+        ocr_engine = AsyncOCREngine(OCR_ENGINE_MODE, OCR_WORKERS, OCR_QUEUE_SIZE)
+        print(f"[INFO] OCR engine: {OCR_ENGINE_MODE} x {ocr_engine.workers}")
+    
+    # 6. 每個鏡頭一條擷取執行緒
+    multi = len(cameras) > 1
+    stop_event = threading.Event()
+    stations = [ScanStation(i, label, cap, inventory, ocr_engine, stop_event, show_label=multi)
+                for i, label, _, cap in cameras]
+    windows = {}
+    for station, (_, label, source, _) in zip(stations, cameras):
+        windows[station] = f"{MAIN_WINDOW_NAME} [{label}]" if multi else MAIN_WINDOW_NAME
+        cv2.namedWindow(windows[station], cv2.WINDOW_NORMAL)
+        if multi:
+            print(f"[INFO] {label}: {source}")
         
-        # 情況 1: 這一幀剛好掃到 -> 直接顯示
-        if current_frame_info:
-            display_info = current_frame_info
-            
-        # 情況 2: 這一幀沒掃到，但距離上次掃到還在 3 秒內 -> 繼續顯示舊的 (視覺暫留)
-        elif last_valid_info and (time.time() - last_valid_time < RESULT_PERSISTENCE_SECONDS):
-            display_info = last_valid_info
-            
-        # 繪製畫面
-        display_frame = draw_overlay(frame, display_info, inventory, fps)
+    # 7. 效能統計 (定期寫檔；有設定埠號時提供 Prometheus 端點)
+    def collect_gauges(metrics: Metrics):
+        for station in stations:
+            metrics.set_gauge('fps', station.fps, camera=station.label)
+            metrics.set_gauge('ocr_queue_depth', station.queue_depth, camera=station.label)
+        metrics.set_gauge('scanned', inventory.scanned_count)
+        metrics.set_gauge('inventory_total', inventory.total_count)
+        metrics.set_gauge('ocr_cache_hit_rate', OCR_CACHE.hit_rate)
+    METRICS.add_collector(collect_gauges)
+    reporter = None
+    if ENABLE_METRICS:
+        reporter = MetricsReporter(METRICS, METRICS_DUMP_SECONDS, METRICS_HTTP_PORT)
+        reporter.start()
         
-        cv2.imshow(MAIN_WINDOW_NAME, display_frame)
-        # cv2.imshow("Debug", cv2.resize(preprocessed, (400, 300))) # 如果想看黑白畫面可打開
+    print("[INFO] Scanner started. Press 'Q' to quit, 'D' to toggle the timing page.")
+    for station in stations:
+        station.start()
+    
+    # 主執行緒只負責顯示與鍵盤
+    shown: Dict[ScanStation, int] = {}
+    while any(station.is_alive() for station in stations):
+        for station in stations:
+            frame = station.latest_frame
+            if frame is not None and shown.get(station) != id(frame):
+                with METRICS.timer('display'):
+                    cv2.imshow(windows[station], frame)
+                # cv2.imshow("Debug", cv2.resize(preprocess_frame(frame), (400, 300))) # 如果想看黑白畫面可打開
+                shown[station] = id(frame)
         
-        frame_count += 1
-        if (cv2.waitKey(1) & 0xFF) in [ord('q'), ord('Q')]:
+        key = cv2.waitKey(1) & 0xFF
+        if key in [ord('q'), ord('Q')]:
             break
-            
-    cap.release()
+        if key in [ord('d'), ord('D')]:
+            for station in stations:
+                station.show_metrics = not station.show_metrics
+    
+    stop_event.set()
+    for station in stations:
+        station.join(timeout=2.0)  # 網路串流可能卡在 read()，不要無限等待
     cv2.destroyAllWindows()
+    for station in stations:
+        if station.scheduler is not None:
+            scheduler = station.scheduler
+            print(f"[INFO] {station.tag}OCR scheduler: {scheduler.fired} calls, saved {scheduler.saved} "
+                  f"(static: {scheduler.skipped_static}, blurry: {scheduler.skipped_blurry})")
+        if station.voter is not None:
+            voter = station.voter
+            print(f"[INFO] {station.tag}CAS voting: {voter.reads} reads, {voter.confirmed} confirmed, "
+                  f"{voter.rejected} below confidence {voter.min_confidence:.0f}")
+    print(f"[INFO] OCR cache: {OCR_CACHE.hits} hits / {OCR_CACHE.misses} misses "
+          f"({OCR_CACHE.hit_rate:.0%}), {len(OCR_CACHE)} entries")
+    if ocr_engine is not None:
+        print(f"[INFO] OCR frames submitted: {ocr_engine.submitted}, dropped (stale): {ocr_engine.dropped}")
+        if multi:
+            print("[INFO] Dropped per camera: " + ", ".join(
+                f"{station.label} {ocr_engine.dropped_by_source[station.source_id]}" for station in stations))
+        ocr_engine.close()
+    get_ocr_backend().close()
+    if reporter is not None:
+        reporter.stop()
+        print(f"[INFO] Metrics saved to: {reporter.json_path}")
+    print("[INFO] Stage timings (ms):")
+    for line in METRICS.summary_lines(STAGE_ORDER):
+        print("    " + line)
     
     # 產生報告
     print("\n[INFO] Generating report...")
-    report_path = inventory.generate_report()
+    if store is not None:
+        # 缺漏報告直接由 SQL 查詢產生 (含櫃名)
+        report_path = store.generate_missing_report(store_session.id)
+        store_session.close()
+    else:
+        report_path = inventory.generate_report()
     print(f"[OK] Report saved to: {report_path}")
+    if journal is not None:
+        # 報告已產生才標記盤點結束；在這之前當掉的話下次啟動會接續
+        journal.close()
+        print(f"[INFO] Scan journal: {journal.written} entries, {journal.syncs} fsyncs")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,382 @@
+"""
+Chemical Bottle Scanner - SQLite Inventory Store
+================================================
+把各櫃的庫存 CSV (Rotavap_Right_Inventory.csv、Clean_Inventory.csv ...) 匯入同一個 SQLite 資料庫：
+- 依 CAS 跨所有櫃子查詢 (有索引)
+- 記錄每一次盤點 (session) 掃到了哪些藥品
+- 任意幾櫃的缺漏報告直接用 SQL 查出，不必手動合併 CSV
+
+用法:
+    python inventory_store.py lab.db import Clean_Inventory.csv "ACG;4.CSV"
+    python inventory_store.py lab.db lookup 64-17-5
+    python inventory_store.py lab.db sessions
+    python inventory_store.py lab.db missing --cabinet Clean_Inventory --cabinet "ACG;4" -o reports/
+
+掃描時在檔案選擇視窗選 .db 檔，再選這次要盤點哪幾櫃 (或設定 cas_scanner.STORE_CABINETS)，
+掃描結果會寫入這幾櫃的盤點工作階段；其他櫃子不會載入，也不會被標記為掃到。
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from cas_scanner import DATA_FOLDER, INVENTORY_HEADER_MAPPING
+
+INVENTORY_COLUMNS = ['CAS', 'Name', 'Location', 'Stock', 'Catalog']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cabinets (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    source TEXT,
+    sha1 TEXT,
+    imported_at TEXT
+);
+CREATE TABLE IF NOT EXISTS bottles (
+    id INTEGER PRIMARY KEY,
+    cabinet_id INTEGER NOT NULL REFERENCES cabinets(id),
+    row INTEGER NOT NULL,
+    cas TEXT NOT NULL,
+    name TEXT NOT NULL,
+    location TEXT NOT NULL,
+    stock TEXT NOT NULL,
+    catalog TEXT NOT NULL DEFAULT ''  -- 型錄編號 (條碼查表用)
+);
+CREATE INDEX IF NOT EXISTS idx_bottles_cas ON bottles(cas, cabinet_id);
+CREATE INDEX IF NOT EXISTS idx_bottles_cabinet ON bottles(cabinet_id, row);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    ended TEXT
+);
+CREATE TABLE IF NOT EXISTS session_cabinets (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    cabinet_id INTEGER NOT NULL REFERENCES cabinets(id),
+    PRIMARY KEY (session_id, cabinet_id)
+) WITHOUT ROWID;
+
+-- 以 (櫃子, CAS) 記錄，重新匯入 CSV 後舊的盤點紀錄仍然有效
+CREATE TABLE IF NOT EXISTS sightings (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    cabinet_id INTEGER NOT NULL REFERENCES cabinets(id),
+    cas TEXT NOT NULL,
+    time TEXT NOT NULL,
+    source TEXT,
+    match TEXT,
+    name TEXT,
+    confidence REAL,
+    PRIMARY KEY (session_id, cabinet_id, cas)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_sightings_cas ON sightings(cas);
+"""
+
+def read_inventory_csv(path: str) -> List[Tuple[str, str, str, str, str]]:
+    """
+    讀取一份庫存 CSV，回傳 (CAS, Name, Location, Stock, Catalog) 列 (沒有型錄編號欄時 Catalog 為空字串)。
+    - 中文標題依 INVENTORY_HEADER_MAPPING 對應
+    - 名稱含逗號卻沒加引號的列 (例如 ACG;4.CSV) 把多出來的欄位併回名稱
+    - 略過重複的標題列與空白列
+    """
+    for encoding in ('utf-8-sig', 'cp950'):  # Excel (繁中 Windows) 另存的 CSV 常是 Big5
+        try:
+            with open(path, 'r', newline='', encoding=encoding) as f:
+                lines = list(csv.reader(f))
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise ValueError(f"Unsupported encoding: {path}")
+    if not lines:
+        return []
+
+    header = [INVENTORY_HEADER_MAPPING.get(h.strip(), h.strip()) for h in lines[0]]
+    if 'CAS' not in header:
+        raise ValueError(f"No CAS column in {path}")
+    name_col = header.index('Name') if 'Name' in header else None
+
+    rows = []
+    for line in lines[1:]:
+        extra = len(line) - len(header)
+        if extra > 0 and name_col is not None:
+            line = line[:name_col] + [','.join(line[name_col:name_col + extra + 1])] + line[name_col + extra + 1:]
+        line = [v.strip() for v in line] + [''] * max(0, -extra)
+        record = dict(zip(header, line))
+        if not any(line) or record['CAS'] == 'CAS':
+            continue
+        rows.append(tuple(record.get(col, '') for col in INVENTORY_COLUMNS))
+    return rows
+
+def _file_sha1(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class StoreSession:
+    """一次盤點：掃到的 CAS 記錄到本次範圍內含有該 CAS 的每一櫃"""
+
+    def __init__(self, store: "InventoryStore", session_id: int):
+        self.store = store
+        self.id = session_id
+
+    def record(self, entry: dict):
+        """寫入一筆掃描 (格式同 ScanJournal 的紀錄)"""
+        self.store._execute("""
+            INSERT OR IGNORE INTO sightings (session_id, cabinet_id, cas, time, source, match, name, confidence)
+            SELECT DISTINCT ?, b.cabinet_id, b.cas, ?, ?, ?, ?, ?
+            FROM bottles b JOIN session_cabinets sc ON sc.cabinet_id = b.cabinet_id AND sc.session_id = ?
+            WHERE b.cas = ?""",
+            (self.id, entry.get('time') or datetime.now().isoformat(timespec='seconds'), entry.get('source'),
+             entry.get('match'), entry.get('name'), entry.get('confidence'), self.id, entry['cas']))
+
+    def scans(self) -> List[dict]:
+        """本次盤點已記錄的掃描 (依時間排序，供接續時重播)"""
+        rows = self.store._query("""
+            SELECT cas, MIN(time), match, name FROM sightings WHERE session_id = ?
+            GROUP BY cas ORDER BY MIN(time)""", (self.id,))
+        return [{'cas': cas, 'time': time, 'match': match, 'name': name} for cas, time, match, name in rows]
+
+    def close(self):
+        self.store._execute("UPDATE sessions SET ended = ? WHERE id = ?",
+                            (datetime.now().isoformat(timespec='seconds'), self.id))
+
+class InventoryStore:
+    """
+    SQLite 庫存資料庫 (WAL 模式)。多個鏡頭的執行緒共用同一個連線，所有操作都經過 self._lock。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._migrate()
+            self._conn.commit()
+
+    def _migrate(self):
+        """舊版資料庫的 bottles 沒有 catalog 欄：補上，並清掉 sha1 讓下次 import 重新匯入型錄編號"""
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(bottles)")]
+        if 'catalog' not in columns:
+            self._conn.execute("ALTER TABLE bottles ADD COLUMN catalog TEXT NOT NULL DEFAULT ''")
+            self._conn.execute("UPDATE cabinets SET sha1 = NULL")
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- 匯入 ---
+
+    def import_csv(self, path: str, cabinet: Optional[str] = None) -> int:
+        """匯入 (或更新) 一櫃的 CSV，回傳筆數；內容沒變 (sha1 相同) 時略過"""
+        cabinet = cabinet or os.path.splitext(os.path.basename(path))[0]
+        sha1 = _file_sha1(path)
+        existing = self._query("SELECT id, sha1 FROM cabinets WHERE name = ?", (cabinet,))
+        if existing and existing[0][1] == sha1:
+            return -1
+        rows = read_inventory_csv(path)
+
+        with self._lock, self._conn:  # 同一個 transaction：匯入失敗時不留下半套資料
+            now = datetime.now().isoformat(timespec='seconds')
+            if existing:
+                cabinet_id = existing[0][0]
+                self._conn.execute("UPDATE cabinets SET source = ?, sha1 = ?, imported_at = ? WHERE id = ?",
+                                   (os.path.abspath(path), sha1, now, cabinet_id))
+                self._conn.execute("DELETE FROM bottles WHERE cabinet_id = ?", (cabinet_id,))
+            else:
+                cabinet_id = self._conn.execute(
+                    "INSERT INTO cabinets (name, source, sha1, imported_at) VALUES (?, ?, ?, ?)",
+                    (cabinet, os.path.abspath(path), sha1, now)).lastrowid
+            self._conn.executemany(
+                "INSERT INTO bottles (cabinet_id, row, cas, name, location, stock, catalog) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((cabinet_id, i) + row for i, row in enumerate(rows)))
+        return len(rows)
+
+    # --- 查詢 ---
+
+    def cabinets(self) -> List[Tuple[str, int]]:
+        """(櫃名, 筆數)"""
+        return self._query("""
+            SELECT c.name, COUNT(b.id) FROM cabinets c LEFT JOIN bottles b ON b.cabinet_id = c.id
+            GROUP BY c.id ORDER BY c.name""")
+
+    def _cabinet_ids(self, cabinets: Optional[List[str]]) -> List[int]:
+        if not cabinets:
+            return [row[0] for row in self._query("SELECT id FROM cabinets ORDER BY name")]
+        ids = []
+        for name in cabinets:
+            found = self._query("SELECT id FROM cabinets WHERE name = ?", (name,))
+            if not found:
+                raise KeyError(f"Unknown cabinet: {name}")
+            ids.append(found[0][0])
+        return ids
+
+    def inventory_table(self, cabinets: Optional[List[str]] = None) -> Tuple[List[str], List[Tuple[str, ...]]]:
+        """給 InventoryManager 用的表格 (欄位同 CSV，多一欄 Cabinet)"""
+        ids = self._cabinet_ids(cabinets)
+        rows = self._query(f"""
+            SELECT b.cas, b.name, b.location, b.stock, b.catalog, c.name FROM bottles b JOIN cabinets c ON c.id = b.cabinet_id
+            WHERE b.cabinet_id IN ({','.join('?' * len(ids))}) ORDER BY c.name, b.row""", tuple(ids))
+        return INVENTORY_COLUMNS + ['Cabinet'], rows
+
+    def lookup(self, cas: str) -> List[Tuple[str, str, str, str]]:
+        """跨所有櫃子查 CAS：(櫃名, 名稱, 廠牌, 數量)"""
+        return self._query("""
+            SELECT c.name, b.name, b.location, b.stock FROM bottles b JOIN cabinets c ON c.id = b.cabinet_id
+            WHERE b.cas = ? ORDER BY c.name, b.row""", (cas,))
+
+    def sightings(self, cas: str) -> List[Tuple[int, str, str, str]]:
+        """哪幾次盤點在哪一櫃掃到這個 CAS：(session, 櫃名, 時間, 來源)"""
+        return self._query("""
+            SELECT s.session_id, c.name, s.time, s.source FROM sightings s JOIN cabinets c ON c.id = s.cabinet_id
+            WHERE s.cas = ? ORDER BY s.session_id, c.name""", (cas,))
+
+    # --- 盤點工作階段 ---
+
+    def start_session(self, cabinets: Optional[List[str]] = None, resume: bool = True) -> StoreSession:
+        """開始一次盤點；resume=True 時若最近一次同範圍的盤點沒有結束 (當機)，就接續它"""
+        ids = self._cabinet_ids(cabinets)
+        if resume:
+            last = self._query("SELECT id, ended FROM sessions ORDER BY id DESC LIMIT 1")
+            if last and last[0][1] is None:
+                scope = [row[0] for row in self._query(
+                    "SELECT cabinet_id FROM session_cabinets WHERE session_id = ? ORDER BY cabinet_id", (last[0][0],))]
+                if scope == sorted(ids):
+                    return StoreSession(self, last[0][0])
+
+        with self._lock, self._conn:
+            session_id = self._conn.execute("INSERT INTO sessions (started) VALUES (?)",
+                                            (datetime.now().isoformat(timespec='seconds'),)).lastrowid
+            self._conn.executemany("INSERT INTO session_cabinets (session_id, cabinet_id) VALUES (?, ?)",
+                                   ((session_id, i) for i in ids))
+        return StoreSession(self, session_id)
+
+    def sessions(self) -> List[Tuple[int, str, Optional[str], int, int]]:
+        """(id, 開始, 結束, 範圍內筆數, 已掃到筆數)"""
+        return self._query("""
+            SELECT se.id, se.started, se.ended,
+                   (SELECT COUNT(*) FROM bottles b JOIN session_cabinets sc ON sc.cabinet_id = b.cabinet_id
+                    WHERE sc.session_id = se.id),
+                   (SELECT COUNT(*) FROM bottles b JOIN sightings s ON s.cabinet_id = b.cabinet_id AND s.cas = b.cas
+                    WHERE s.session_id = se.id)
+            FROM sessions se ORDER BY se.id""")
+
+    def latest_session_id(self) -> Optional[int]:
+        rows = self._query("SELECT MAX(id) FROM sessions")
+        return rows[0][0] if rows else None
+
+    # --- 報告 ---
+
+    def missing(self, session_id: int, cabinets: Optional[List[str]] = None) -> List[Tuple[str, ...]]:
+        """某次盤點中，指定櫃子 (預設為該次盤點的範圍) 還沒掃到的藥品"""
+        if cabinets:
+            ids = self._cabinet_ids(cabinets)
+        else:
+            ids = [row[0] for row in self._query(
+                "SELECT cabinet_id FROM session_cabinets WHERE session_id = ?", (session_id,))]
+        return self._query(f"""
+            SELECT b.cas, b.name, b.location, b.stock, b.catalog, c.name FROM bottles b JOIN cabinets c ON c.id = b.cabinet_id
+            WHERE b.cabinet_id IN ({','.join('?' * len(ids))})
+              AND NOT EXISTS (SELECT 1 FROM sightings s
+                              WHERE s.session_id = ? AND s.cabinet_id = b.cabinet_id AND s.cas = b.cas)
+            ORDER BY c.name, b.row""", tuple(ids) + (session_id,))
+
+    def generate_missing_report(self, session_id: int, cabinets: Optional[List[str]] = None,
+                                output_dir: Optional[str] = None) -> str:
+        """缺漏報告 (欄位同 CSV 報告，多一欄 Cabinet)"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+        output_dir = output_dir or DATA_FOLDER
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"missing_report_session{session_id}_{timestamp}.csv")
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(INVENTORY_COLUMNS + ['Cabinet'])
+            writer.writerows(self.missing(session_id, cabinets))
+        return path
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Multi-cabinet inventory database (SQLite).")
+    parser.add_argument('database', help="SQLite 資料庫檔 (不存在會自動建立)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p_import = commands.add_parser('import', help="匯入一或多份庫存 CSV")
+    p_import.add_argument('csv_files', nargs='+')
+    p_import.add_argument('--cabinet', help="櫃名 (只匯入一個檔案時可指定；預設為檔名)")
+
+    p_lookup = commands.add_parser('lookup', help="跨所有櫃子查詢 CAS")
+    p_lookup.add_argument('cas')
+
+    commands.add_parser('cabinets', help="列出所有櫃子")
+    commands.add_parser('sessions', help="列出所有盤點")
+
+    p_missing = commands.add_parser('missing', help="產生缺漏報告")
+    p_missing.add_argument('--session', type=int, help="盤點編號 (預設: 最近一次)")
+    p_missing.add_argument('--cabinet', action='append', help="只看這幾櫃 (可重複指定)")
+    p_missing.add_argument('-o', '--output', default=DATA_FOLDER, help="報告輸出資料夾")
+    args = parser.parse_args(argv)
+
+    store = InventoryStore(args.database)
+    try:
+        if args.command == 'import':
+            if args.cabinet and len(args.csv_files) > 1:
+                print("[ERROR] --cabinet can only be used with a single CSV file.")
+                return 1
+            for path in args.csv_files:
+                count = store.import_csv(path, args.cabinet)
+                name = args.cabinet or os.path.splitext(os.path.basename(path))[0]
+                print(f"[OK] {name}: unchanged" if count < 0 else f"[OK] {name}: {count} rows")
+
+        elif args.command == 'lookup':
+            rows = store.lookup(args.cas)
+            for cabinet, name, location, stock in rows:
+                print(f"[FOUND] {cabinet}: {name} @ {location} ({stock})")
+            for session_id, cabinet, time, source in store.sightings(args.cas):
+                print(f"[INFO] Seen in session {session_id} ({cabinet}) at {time} {source or ''}")
+            if not rows:
+                print(f"[INFO] {args.cas} not in any cabinet.")
+
+        elif args.command == 'cabinets':
+            for name, count in store.cabinets():
+                print(f"{name}: {count}")
+
+        elif args.command == 'sessions':
+            for session_id, started, ended, total, found in store.sessions():
+                print(f"#{session_id}  {started} ~ {ended or '(unfinished)'}  {found} / {total}")
+
+        elif args.command == 'missing':
+            session_id = args.session or store.latest_session_id()
+            if session_id is None:
+                print("[ERROR] No sessions in database.")
+                return 1
+            path = store.generate_missing_report(session_id, args.cabinet, args.output)
+            print(f"[OK] Missing report: {path}")
+    except (KeyError, ValueError, OSError) as e:
+        print(f"[ERROR] {e.args[0] if isinstance(e, KeyError) else e}")
+        return 1
+    finally:
+        store.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,28 +2,40 @@
 Chemical Bottle Scanner - Mobile Launcher
 =========================================
 透過手機當作鏡頭（DroidCam）來執行掃描程式。
+可以同時接多支手機 / 鏡頭，各自掃不同的櫃子，全部記錄到同一份盤點：
+
+    python run_mobile.py                                  # 只用 DroidCam (攝影機索引 1)
+    python run_mobile.py 0 1                              # 電腦內建鏡頭 + DroidCam
+    python run_mobile.py 1 http://192.168.1.20:4747/video # DroidCam + 另一支手機的 IP 串流
 """
 
+import sys
+import time
+_launch_start = time.perf_counter()
+
 # 正確 import 主程式模組
 import cas_scanner
 
+print(f"[Launcher] 載入主程式: {(time.perf_counter() - _launch_start) * 1000:.0f} ms")
+
 # =========================================================
-# 修改攝影機設定為手機鏡頭
+# 手機鏡頭設定
 # =========================================================
 
-print("[Launcher] 正在切換至手機鏡頭模式...")
-print("[Launcher] 請確認 DroidCam 已開啟並連線。")
-
-# 將攝影機索引從 0 (電腦內建) 改成 1 (DroidCam)
-# 如果 1 沒畫面，可以試試 2
-cas_scanner.CAMERA_INDEX = 1
+# 預設使用 DroidCam (攝影機索引 1，0 是電腦內建鏡頭)
+# 如果 1 沒畫面，可以試試 2；也可以直接在命令列指定多個來源
+MOBILE_SOURCES = [1]
 
 # =========================================================
 # 執行主程式 (含例外處理)
 # =========================================================
 if __name__ == "__main__":
+    sources = sys.argv[1:] or MOBILE_SOURCES
+    print("[Launcher] 正在切換至手機鏡頭模式...")
+    print("[Launcher] 請確認 DroidCam 已開啟並連線。")
+    print(f"[Launcher] 鏡頭來源: {', '.join(map(str, sources))}")
     try:
-        cas_scanner.main()
+        cas_scanner.main(sources)
     except Exception as e:
         print(f"\n[Launcher Error] 發生錯誤: {e}")
         print("=" * 50)